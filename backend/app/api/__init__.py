@@ -11,6 +11,7 @@ def debug_log(msg):
 from app.api import articles
 from app.api import categories
 from app.api import related
+from app.api import stories
 from app.api import thumbnails
 from app.api import sources
 from app.api import admin
@@ -21,6 +22,7 @@ __all__ = [
     'articles',
     'categories',
     'related',
+    'stories',
     'thumbnails',
     'sources',
     'admin',
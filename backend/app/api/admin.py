@@ -7,7 +7,11 @@ import xml.etree.ElementTree as ET
 from fastapi.responses import Response
 from app.freshrss_api_ext import FreshRSSAPIExt
 import traceback
-from app.workers.tasks import process_articles, enrich_articles
+from app.workers.tasks import (
+    process_articles, enrich_articles, train_category_classifier, start_category_rebuild, get_category_rebuild_status,
+    start_related_rebuild, get_related_rebuild_status
+)
+from app.workers.categorizer import ollama_breaker
 from app.models.database import Article
 from sqlalchemy.orm import Session
 from app.database import get_db
@@ -63,15 +67,31 @@ def delete_source(id: int, user=Depends(require_role(["admin", "poweruser"]))):
 # --- Rebuild Operations ---
 @router.post("/categories/rebuild", summary="Rebuild categories for all sources (admin)")
 def rebuild_categories_all(user=Depends(require_role(["admin", "poweruser"]))):
-    return {"message": "Rebuild categories for all sources (placeholder)"}
+    return start_category_rebuild()
 
 @router.post("/categories/rebuild/{source_id}", summary="Rebuild categories for a specific source (admin)")
 def rebuild_categories_source(source_id: int, user=Depends(require_role(["admin", "poweruser"]))):
-    return {"message": f"Rebuild categories for source {source_id} (placeholder)"}
+    feeds_response = get_freshrss_client().get_feeds()
+    feeds = feeds_response.get('feeds', []) if isinstance(feeds_response, dict) else feeds_response
+    feed = next((f for f in feeds if str(f.get('id')) == str(source_id)), None)
+    if not feed:
+        raise HTTPException(status_code=404, detail=f"Source {source_id} not found")
+    # Articles store the feed's website URL (GReader origin.htmlUrl) as source_url
+    if not feed.get('site_url'):
+        raise HTTPException(status_code=400, detail=f"Source {source_id} has no website URL")
+    return start_category_rebuild(feed['site_url'])
+
+@router.get("/categories/rebuild/status", summary="Get category rebuild progress (admin)")
+def rebuild_categories_status(user=Depends(require_role(["admin", "poweruser"]))):
+    return get_category_rebuild_status()
 
 @router.post("/related/rebuild", summary="Rebuild related articles (admin)")
 def rebuild_related(user=Depends(require_role(["admin", "poweruser"]))):
-    return {"message": "Rebuild related articles (placeholder)"}
+    return start_related_rebuild()
+
+@router.get("/related/rebuild/status", summary="Get related articles rebuild progress (admin)")
+def rebuild_related_status(user=Depends(require_role(["admin", "poweruser"]))):
+    return get_related_rebuild_status()
 
 # --- Settings Management ---
 @router.get("/settings/", summary="Get settings (admin)")
@@ -194,6 +214,15 @@ def trigger_enrich_articles(user=Depends(require_role(["admin", "poweruser"]))):
     result = enrich_articles.delay()
     return {"status": "ok", "message": "Article enrichment task triggered.", "task_id": result.id}
 
+@router.post("/workers/train-classifier", summary="Retrain the local category classifier (admin)")
+def trigger_train_classifier(user=Depends(require_role(["admin", "poweruser"]))):
+    result = train_category_classifier.delay()
+    return {"status": "ok", "message": "Category classifier training task triggered.", "task_id": result.id}
+
+@router.get("/workers/ollama-breaker", summary="Get the Ollama circuit breaker state (admin)")
+def get_ollama_breaker(user=Depends(require_role(["admin", "poweruser"]))):
+    return ollama_breaker.status()
+
 @router.get("/sources/stats", summary="Get sources stats (admin)")
 def get_sources_stats(user=Depends(require_role(["admin", "poweruser"])), db: Session = Depends(get_db)):
     client = get_freshrss_client()
@@ -58,6 +58,7 @@ async def get_articles(
     category: str = None,
     source: str = None,
     search: str = None,
+    group_stories: bool = False,
     db: Session = Depends(get_db)
 ):
     """
@@ -68,6 +69,7 @@ async def get_articles(
     - **category**: Filter by category name
     - **source**: Filter by source name
     - **search**: Search in title and description
+    - **group_stories**: Return only the newest article of each story, with the story's article count in `story_size`
     """
     return ArticleService.get_articles(
         db=db,
@@ -75,7 +77,8 @@ async def get_articles(
         limit=limit,
         category=category,
         source=source,
-        search=search
+        search=search,
+        group_stories=group_stories
     )
 
 @router.get("/{article_id}")
@@ -0,0 +1,20 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.orm import Session
+from app.database import get_db
+from app.caching import cache_response
+from app.services.story import StoryService
+from app.config import get_settings
+
+router = APIRouter()
+
+settings = get_settings()
+
+@router.get("/{story_id}")
+@cache_response(expire_seconds=settings.article_list_cache_expire)
+async def get_story(story_id: int, db: Session = Depends(get_db)):
+    """
+    Get all articles of a story in one request.
+
+    - **story_id**: ID of the story, as returned in `story_id` by the articles list
+    """
+    return StoryService.get_story(db, story_id)
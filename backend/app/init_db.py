@@ -1,8 +1,30 @@
+from sqlalchemy import text
 from app.database import engine
 from app.models.database import Base
 
+# Columns added to existing tables after their first release.
+# create_all only creates missing tables, so these are added in place.
+ADDED_COLUMNS = [
+    ('articles', 'content_hash', 'VARCHAR(64)'),
+    ('articles', 'simhash', 'BIGINT'),
+    ('articles', 'canonical_id', 'INTEGER REFERENCES articles(id) ON DELETE SET NULL'),
+    ('articles', 'minhash', 'BYTEA'),
+    ('articles', 'story_id', 'INTEGER REFERENCES stories(id) ON DELETE SET NULL'),
+    ('article_category', 'source', 'VARCHAR(16)'),
+]
+
+# Indexes on the added columns, which create_all does not create on existing tables either
+ADDED_INDEXES = [
+    ('ix_articles_story_id', 'articles', 'story_id'),
+]
+
 def init_db():
     Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for table, column, column_type in ADDED_COLUMNS:
+            conn.execute(text(f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {column_type}'))
+        for index, table, column in ADDED_INDEXES:
+            conn.execute(text(f'CREATE INDEX IF NOT EXISTS {index} ON {table} ({column})'))
 
 if __name__ == "__main__":
-    init_db() 
\ No newline at end of file
+    init_db()
@@ -1,6 +1,6 @@
 from fastapi import FastAPI, APIRouter
 from fastapi.middleware.cors import CORSMiddleware
-from app.api import articles, categories, related, thumbnails, sources
+from app.api import articles, categories, related, stories, thumbnails, sources
 from app.api import admin
 from app.api import auth
 from app.api import user
@@ -50,6 +50,7 @@ api_router = APIRouter(prefix=settings.api_prefix)
 api_router.include_router(articles.router, prefix="/articles", tags=["articles"])
 api_router.include_router(categories.router, prefix="/categories", tags=["categories"])
 api_router.include_router(related.router, prefix="/related", tags=["related"])
+api_router.include_router(stories.router, prefix="/stories", tags=["stories"])
 api_router.include_router(thumbnails.router, prefix="/thumbnails", tags=["thumbnails"])
 api_router.include_router(sources.router, prefix="/sources", tags=["sources"])
 api_router.include_router(admin.router, prefix="/admin", tags=["admin"])
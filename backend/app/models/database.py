@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Table, Boolean, JSON
+from sqlalchemy import Column, Integer, BigInteger, SmallInteger, String, Text, DateTime, ForeignKey, Table, Boolean, JSON, Index, LargeBinary
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
@@ -10,7 +10,8 @@ article_category = Table(
     'article_category',
     Base.metadata,
     Column('article_id', Integer, ForeignKey('articles.id')),
-    Column('category_id', Integer, ForeignKey('categories.id'))
+    Column('category_id', Integer, ForeignKey('categories.id')),
+    Column('source', String(16))  # What assigned the category, see app.workers.classifier; NULL if unknown or copied
 )
 
 # Association table for many-to-many relationship between articles and related articles
@@ -21,6 +22,44 @@ article_related = Table(
     Column('related_article_id', Integer, ForeignKey('articles.id'))
 )
 
+# SimHash band index used to find near-duplicate articles without scanning the table
+article_simhash_band = Table(
+    'article_simhash_band',
+    Base.metadata,
+    Column('article_id', Integer, ForeignKey('articles.id', ondelete='CASCADE'), nullable=False),
+    Column('band', SmallInteger, nullable=False),
+    Column('value', Integer, nullable=False),
+    Index('article_simhash_band_lookup_idx', 'band', 'value')
+)
+
+# Inverted index from normalized title tokens to articles, used to find related-article candidates
+article_title_token = Table(
+    'article_title_token',
+    Base.metadata,
+    Column('token', String(64), primary_key=True),
+    Column('article_id', Integer, ForeignKey('articles.id', ondelete='CASCADE'), primary_key=True),
+    Index('article_title_token_article_idx', 'article_id')
+)
+
+# MinHash-LSH band index used to find related-article candidates
+article_minhash_band = Table(
+    'article_minhash_band',
+    Base.metadata,
+    Column('article_id', Integer, ForeignKey('articles.id', ondelete='CASCADE'), nullable=False),
+    Column('band', SmallInteger, nullable=False),
+    Column('value', BigInteger, nullable=False),
+    Index('article_minhash_band_lookup_idx', 'band', 'value')
+)
+
+# Related links computed by an admin rebuild, swapped into article_related when the whole rebuild finishes
+article_related_staging = Table(
+    'article_related_staging',
+    Base.metadata,
+    Column('job_id', String(32), nullable=False, index=True),
+    Column('article_id', Integer, ForeignKey('articles.id', ondelete='CASCADE'), nullable=False),
+    Column('related_article_id', Integer, ForeignKey('articles.id', ondelete='CASCADE'), nullable=False)
+)
+
 class Article(Base):
     __tablename__ = 'articles'
 
@@ -37,6 +76,11 @@ class Article(Base):
     processed_at = Column(DateTime, default=datetime.utcnow)
     is_processed = Column(Boolean, default=False)
     image_url = Column(String(1000))
+    content_hash = Column(String(64))  # Fingerprint of title, summary and enclosure from FreshRSS
+    simhash = Column(BigInteger)  # SimHash of title and summary, stored signed
+    canonical_id = Column(Integer, ForeignKey('articles.id', ondelete='SET NULL'))  # Set on near-duplicates
+    minhash = Column(LargeBinary)  # MinHash signature of title and description, int32 values
+    story_id = Column(Integer, ForeignKey('stories.id', ondelete='SET NULL'), index=True)  # Cluster of related articles
     
     # Relationships
     categories = relationship('Category', secondary=article_category, back_populates='articles')
@@ -48,6 +92,14 @@ class Article(Base):
         backref='related_to'
     )
 
+class Story(Base):
+    """A cluster of articles about the same story, joined by their related-article links."""
+    __tablename__ = 'stories'
+
+    id = Column(Integer, primary_key=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 class Category(Base):
     __tablename__ = 'categories'
 
@@ -5,6 +5,7 @@ Services package for business logic.
 from app.services.article import ArticleService
 from app.services.category import CategoryService
 from app.services.related import RelatedService
+from app.services.story import StoryService
 from app.services.auth import AuthService
 from app.services.freshrss import FreshRSSService
 from app.services.user import UserService
@@ -13,6 +14,7 @@ __all__ = [
     'ArticleService',
     'CategoryService',
     'RelatedService',
+    'StoryService',
     'AuthService',
     'FreshRSSService',
     'UserService',
@@ -1,5 +1,5 @@
 from typing import Dict, List, Any, Optional
-from sqlalchemy import desc
+from sqlalchemy import desc, func
 from sqlalchemy.orm import Session
 from app.models.database import Article, Category
 from app.freshrss_api_ext import FreshRSSAPIExt
@@ -43,7 +43,8 @@ class ArticleService:
                 {"id": str(rel.id), "title": rel.title, "url": rel.link}
                 for rel in article.related_articles
             ],
-            "thumbnail_url": thumbnail_url
+            "thumbnail_url": thumbnail_url,
+            "story_id": str(article.story_id) if article.story_id else None
         }
     
     @staticmethod
@@ -78,9 +79,10 @@ class ArticleService:
         limit: int = 20,
         category: Optional[str] = None,
         source: Optional[str] = None,
-        search: Optional[str] = None
+        search: Optional[str] = None,
+        group_stories: bool = False
     ) -> Dict[str, Any]:
-        """Get articles with optional filtering."""
+        """Get articles with optional filtering, optionally collapsed to one article per story."""
         # Build base query
         query = db.query(Article).filter(Article.is_processed == True)
 
@@ -95,6 +97,9 @@ class ArticleService:
                 (Article.description.ilike(f"%{search}%"))
             )
 
+        if group_stories:
+            return ArticleService.get_story_representatives(db, query, skip, limit)
+
         # Get total count for pagination
         total = query.count()
 
@@ -111,6 +116,50 @@ class ArticleService:
             "limit": limit
         }
     
+    @staticmethod
+    def get_story_representatives(db: Session, query, skip: int, limit: int) -> Dict[str, Any]:
+        """
+        Page through the newest matching article of each story, with the
+        story's article count. Articles outside any story stand on their own.
+        """
+        story_key = func.coalesce(Article.story_id, -Article.id)
+        ranked = query.with_entities(
+            Article.id.label("id"),
+            Article.published_at.label("published_at"),
+            func.row_number().over(
+                partition_by=story_key, order_by=(desc(Article.published_at), desc(Article.id))
+            ).label("rank")
+        ).subquery()
+        representatives = db.query(ranked.c.id).filter(ranked.c.rank == 1)
+
+        total = representatives.count()
+        page_ids = [
+            row.id for row in representatives.order_by(desc(ranked.c.published_at), desc(ranked.c.id))
+            .offset(skip).limit(limit)
+        ]
+        articles = db.query(Article).filter(Article.id.in_(page_ids)).all() if page_ids else []
+        articles.sort(key=lambda article: page_ids.index(article.id))
+
+        story_ids = {article.story_id for article in articles if article.story_id}
+        sizes = dict(
+            db.query(Article.story_id, func.count())
+            .filter(Article.story_id.in_(story_ids), Article.is_processed == True)
+            .group_by(Article.story_id).all()
+        ) if story_ids else {}
+
+        formatted_articles = []
+        for article in articles:
+            formatted = ArticleService.format_article(article)
+            formatted["story_size"] = sizes.get(article.story_id, 1) if article.story_id else 1
+            formatted_articles.append(formatted)
+
+        return {
+            "articles": formatted_articles,
+            "total": total,
+            "skip": skip,
+            "limit": limit
+        }
+
     @staticmethod
     def get_article_by_id(db: Session, article_id: int) -> Dict[str, Any]:
         """Get a single article by ID."""
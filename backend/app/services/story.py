@@ -0,0 +1,31 @@
+from typing import Dict, Any
+from sqlalchemy import desc
+from sqlalchemy.orm import Session, selectinload
+from app.models.database import Article, Story
+from app.services.article import ArticleService
+from fastapi import HTTPException
+
+class StoryService:
+    """Service for story-related operations."""
+
+    @staticmethod
+    def get_story(db: Session, story_id: int) -> Dict[str, Any]:
+        """Get every article of a story, newest first."""
+        story = db.query(Story).filter(Story.id == story_id).first()
+        if not story:
+            raise HTTPException(status_code=404, detail="Story not found")
+
+        # Load categories and related articles up front instead of once per member
+        articles = (
+            db.query(Article)
+            .options(selectinload(Article.categories), selectinload(Article.related_articles))
+            .filter(Article.story_id == story_id, Article.is_processed == True)
+            .order_by(desc(Article.published_at), desc(Article.id))
+            .all()
+        )
+
+        return {
+            "id": str(story.id),
+            "articles": [ArticleService.format_article(article) for article in articles],
+            "total": len(articles)
+        }
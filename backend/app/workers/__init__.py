@@ -1 +1,8 @@
- 
\ No newline at end of file
+"""
+Workers package for Celery tasks and the ingestion helpers they use.
+"""
+
+import os
+def debug_log(msg):
+    if os.environ.get('BACKEND_DEBUG', '').lower() == 'true':
+        print(f'[DEBUG] {msg}')
@@ -0,0 +1,123 @@
+"""
+Circuit breaker shared by all worker processes.
+
+The breaker state lives in one Redis hash, so once any worker process has
+seen BREAKER_FAILURES consecutive failures every process stops calling the
+service. After BREAKER_COOLDOWN seconds the breaker is half-open: one
+process (chosen by a short Redis lock) probes the service's health, and
+the breaker closes again only if the probe succeeds. Open and close
+transitions are counted for the admin API.
+"""
+
+import os
+import time
+from typing import Any, Dict
+
+import redis
+
+from app.workers import debug_log
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+BREAKER_FAILURES = int(os.environ.get('WORKER_BREAKER_FAILURES', 3))
+BREAKER_COOLDOWN = int(os.environ.get('WORKER_BREAKER_COOLDOWN', 60))
+
+redis_client = redis.Redis.from_url(os.getenv('REDIS_URL', 'redis://redis:6379/0'), decode_responses=True)
+
+# KEYS[1] breaker hash; ARGV[1] failure threshold; ARGV[2] error; ARGV[3] now. Returns 1 if this failure opened the breaker.
+_RECORD_FAILURE_SCRIPT = """
+local failures = redis.call('HINCRBY', KEYS[1], 'failures', 1)
+redis.call('HSET', KEYS[1], 'last_error', ARGV[2], 'last_failure_at', ARGV[3])
+if redis.call('HGET', KEYS[1], 'state') == 'open' then
+    redis.call('HSET', KEYS[1], 'opened_at', ARGV[3])
+    return 0
+end
+if failures >= tonumber(ARGV[1]) then
+    redis.call('HSET', KEYS[1], 'state', 'open', 'opened_at', ARGV[3])
+    redis.call('HINCRBY', KEYS[1], 'opens', 1)
+    return 1
+end
+return 0
+"""
+
+# KEYS[1] breaker hash. Returns 1 if this success closed the breaker.
+_RECORD_SUCCESS_SCRIPT = """
+redis.call('HSET', KEYS[1], 'failures', 0)
+if redis.call('HGET', KEYS[1], 'state') == 'open' then
+    redis.call('HSET', KEYS[1], 'state', 'closed')
+    redis.call('HINCRBY', KEYS[1], 'closes', 1)
+    return 1
+end
+return 0
+"""
+_record_failure = redis_client.register_script(_RECORD_FAILURE_SCRIPT)
+_record_success = redis_client.register_script(_RECORD_SUCCESS_SCRIPT)
+
+
+class CircuitBreaker:
+    """Redis-backed breaker for one service. An unavailable Redis leaves the breaker closed."""
+
+    def __init__(self, name: str, failures: int = BREAKER_FAILURES, cooldown: int = BREAKER_COOLDOWN):
+        self.name = name
+        self.failures = failures
+        self.cooldown = cooldown
+
+    @property
+    def key(self) -> str:
+        return f'breaker:{self.name}'
+
+    def state(self) -> str:
+        try:
+            state, opened_at = redis_client.hmget(self.key, 'state', 'opened_at')
+        except redis.RedisError as e:
+            debug_log(f'Circuit breaker {self.name} unavailable: {e}')
+            return CLOSED
+        if state != OPEN:
+            return CLOSED
+        if time.time() - float(opened_at or 0) >= self.cooldown:
+            return HALF_OPEN
+        return OPEN
+
+    def is_closed(self) -> bool:
+        return self.state() == CLOSED
+
+    def try_probe(self) -> bool:
+        """Claim the single health probe of a half-open breaker across all processes."""
+        if self.state() != HALF_OPEN:
+            return False
+        try:
+            return bool(redis_client.set(f'{self.key}:probe', '1', nx=True, ex=self.cooldown))
+        except redis.RedisError:
+            return False
+
+    def record_success(self):
+        try:
+            if _record_success(keys=[self.key]):
+                debug_log(f'Circuit breaker {self.name} closed')
+        except redis.RedisError as e:
+            debug_log(f'Circuit breaker {self.name} unavailable: {e}')
+
+    def record_failure(self, error: str):
+        try:
+            if _record_failure(keys=[self.key], args=[self.failures, error[:200], time.time()]):
+                debug_log(f'Circuit breaker {self.name} opened after {self.failures} failures: {error}')
+        except redis.RedisError as e:
+            debug_log(f'Circuit breaker {self.name} unavailable: {e}')
+
+    def status(self) -> Dict[str, Any]:
+        try:
+            data = redis_client.hgetall(self.key)
+        except redis.RedisError as e:
+            return {'name': self.name, 'state': CLOSED, 'error': str(e)}
+        return {
+            'name': self.name,
+            'state': self.state(),
+            'consecutive_failures': int(data.get('failures', 0)),
+            'opens': int(data.get('opens', 0)),
+            'closes': int(data.get('closes', 0)),
+            'opened_at': float(data['opened_at']) if data.get('opened_at') else None,
+            'last_failure_at': float(data['last_failure_at']) if data.get('last_failure_at') else None,
+            'last_error': data.get('last_error'),
+        }
@@ -0,0 +1,369 @@
+"""
+Article categorization with Ollama, falling back to keyword matching.
+
+Articles are sent to Ollama several at a time: one prompt carries
+OLLAMA_BATCH_SIZE articles and asks for a JSON object keyed by article
+id. Up to OLLAMA_CONCURRENCY of those batches run at once over one
+pooled httpx.AsyncClient per worker process. Any article the model does
+not answer for falls back to keyword_based_categorization on its own.
+
+When a local classifier has been trained (see app.workers.classifier),
+it runs first and only the articles it is not confident about are sent
+to Ollama.
+
+Ollama calls go through a circuit breaker shared by all workers (see
+app.workers.breaker): after repeated failures every worker skips Ollama
+until a health probe of /api/tags succeeds, and one run never waits on
+Ollama for longer than OLLAMA_RUN_BUDGET seconds.
+
+Model answers are cached in Redis under a hash of the normalized article
+text, the model name and CATEGORY_PROMPT_VERSION, so re-fetched, purged
+and re-added or tracking-parameter duplicates of an article never cost a
+second Ollama call. Keyword fallbacks are not cached.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+import redis
+
+from app.workers import debug_log
+from app.workers.breaker import CircuitBreaker
+from app.workers.classifier import CLASSIFIER_CONFIDENCE, LABEL_CLASSIFIER, LABEL_KEYWORDS, LABEL_MODEL, classify_texts
+
+CATEGORIES = [
+    'Politics', 'US', 'World', 'Sports', 'Technology',
+    'Entertainment', 'Science', 'Health', 'Business'
+]
+
+# Keywords are whole words or phrases; a trailing plural "s"/"es" also matches lowercase keywords.
+# Keywords with capitals (acronyms) match case-sensitively, so 'US' does not match 'us'.
+# An entry may be (keyword, weight) for terms that are weaker evidence on their own.
+CATEGORY_KEYWORDS = {
+    'Politics': ['election', 'government', 'senate', 'congress', 'president', 'politics', ('law', 0.5), 'policy', 'minister', 'parliament'],
+    'US': ['united states', 'america', 'US', 'U.S.', 'USA', 'american', 'washington', 'new york', 'california'],
+    'World': ['world', 'global', 'international', 'foreign', 'abroad', 'overseas'],
+    'Sports': ['sport', ('game', 0.5), ('match', 0.5), 'tournament', 'league', 'nba', 'nfl', 'mlb', 'soccer', 'football', 'basketball', 'olympics'],
+    'Technology': ['tech', 'technology', 'software', 'hardware', 'computer', 'AI', 'artificial intelligence', 'internet', ('app', 0.5), 'gadget', ('device', 0.5)],
+    'Entertainment': ['movie', 'film', 'music', 'entertainment', 'tv', ('show', 0.5), 'celebrity', 'concert', 'festival'],
+    'Science': ['science', ('research', 0.5), ('study', 0.5), 'scientist', ('space', 0.5), 'nasa', 'physics', 'chemistry', 'biology'],
+    'Health': ['health', 'medicine', 'medical', 'doctor', 'hospital', 'disease', 'virus', 'covid', 'wellness'],
+    'Business': ['business', ('market', 0.5), 'stock', 'finance', 'economy', ('trade', 0.5), ('company', 0.5), 'corporate', 'industry'],
+}
+# Weighted keyword hits a category needs before the fallback assigns it
+KEYWORD_MIN_SCORE = float(os.environ.get('KEYWORD_MIN_SCORE', 1.0))
+
+OLLAMA_MODEL = os.getenv('OLLAMA_MODEL', 'llama2')
+OLLAMA_BATCH_SIZE = int(os.environ.get('OLLAMA_BATCH_SIZE', 8))
+OLLAMA_CONCURRENCY = int(os.environ.get('OLLAMA_CONCURRENCY', 2))
+OLLAMA_TIMEOUT = float(os.environ.get('OLLAMA_TIMEOUT', 120))
+# Seconds one categorize_texts call may spend waiting on Ollama before the rest falls back
+OLLAMA_RUN_BUDGET = float(os.environ.get('OLLAMA_RUN_BUDGET', 150))
+OLLAMA_PROBE_TIMEOUT = float(os.environ.get('OLLAMA_PROBE_TIMEOUT', 5))
+# Characters of each article sent to the model
+OLLAMA_MAX_ARTICLE_CHARS = int(os.environ.get('OLLAMA_MAX_ARTICLE_CHARS', 1000))
+
+# Bump whenever the prompt or the parsing of its answer changes
+CATEGORY_PROMPT_VERSION = 2
+CATEGORY_CACHE_TTL = int(os.environ.get('CATEGORY_CACHE_TTL', 30 * 86400))
+CATEGORY_CACHE_PREFIX = 'catcache'
+
+_TAG_RE = re.compile(r'<[^>]+>')
+_WHITESPACE_RE = re.compile(r'\s+')
+_NON_WORD_RE = re.compile(r'[^\w\s]')
+
+redis_client = redis.Redis.from_url(os.getenv('REDIS_URL', 'redis://redis:6379/0'), decode_responses=True)
+
+ollama_breaker = CircuitBreaker('ollama')
+
+_client: Optional[httpx.AsyncClient] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _compile_keyword_matcher(keywords: Dict[str, List[Tuple[str, float]]], case_sensitive: bool):
+    if not keywords:
+        return None
+    # Longest first so 'artificial intelligence' wins over shorter overlapping keywords
+    alternation = '|'.join(
+        re.escape(keyword).replace('\\ ', '\\s+') for keyword in sorted(keywords, key=len, reverse=True)
+    )
+    if case_sensitive:
+        return re.compile(rf'(?<!\w)({alternation})(?!\w)')
+    # Matched against lowercased text: re.IGNORECASE defeats the literal-prefix optimisation
+    return re.compile(rf'(?<!\w)({alternation})(?:e?s)?(?!\w)')
+
+
+def _build_keyword_index():
+    insensitive: Dict[str, List[Tuple[str, float]]] = {}
+    sensitive: Dict[str, List[Tuple[str, float]]] = {}
+    for category, keywords in CATEGORY_KEYWORDS.items():
+        for entry in keywords:
+            keyword, weight = (entry, 1.0) if isinstance(entry, str) else entry
+            keyword = keyword.strip()
+            if keyword == keyword.lower():
+                insensitive.setdefault(keyword, []).append((category, weight))
+            else:
+                sensitive.setdefault(keyword, []).append((category, weight))
+    return (
+        (_compile_keyword_matcher(insensitive, False), insensitive, True),
+        (_compile_keyword_matcher(sensitive, True), sensitive, False),
+    )
+
+
+# Two compiled alternations (lowercase words, case-sensitive acronyms) scan the text once each
+_KEYWORD_MATCHERS = _build_keyword_index()
+
+
+def keyword_scores(text: str) -> Dict[str, float]:
+    """Weighted keyword hit count per category, in one regex pass over the text per matcher."""
+    text = _TAG_RE.sub(' ', text or '')
+    lowered = text.lower()
+    scores: Dict[str, float] = {}
+    for pattern, index, lowercase in _KEYWORD_MATCHERS:
+        if pattern is None:
+            continue
+        for match in pattern.finditer(lowered if lowercase else text):
+            key = _WHITESPACE_RE.sub(' ', match.group(1))
+            for category, weight in index.get(key, ()):
+                scores[category] = scores.get(category, 0.0) + weight
+    return scores
+
+
+def keyword_based_categorization(text: str) -> List[str]:
+    """Fallback categorization using keyword matching: up to 3 categories, highest score first."""
+    scores = keyword_scores(text)
+    ranked = sorted((category for category, score in scores.items() if score >= KEYWORD_MIN_SCORE),
+                    key=lambda category: -scores[category])
+    return ranked[:3]
+
+
+def get_ollama_client() -> httpx.AsyncClient:
+    """Pooled client shared by every categorization on the current event loop."""
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client_loop is not loop:
+        _client = httpx.AsyncClient(
+            timeout=OLLAMA_TIMEOUT,
+            limits=httpx.Limits(max_connections=OLLAMA_CONCURRENCY, max_keepalive_connections=OLLAMA_CONCURRENCY)
+        )
+        _client_loop = loop
+    return _client
+
+
+def clean_text(text: str) -> str:
+    """Strip HTML and collapse whitespace so the prompt only carries readable text."""
+    return _WHITESPACE_RE.sub(' ', _TAG_RE.sub(' ', text or '')).strip()[:OLLAMA_MAX_ARTICLE_CHARS]
+
+
+def category_cache_namespace() -> str:
+    # The category list is part of the prompt, so changing CATEGORIES starts a fresh namespace
+    categories = hashlib.sha256('|'.join(CATEGORIES).encode('utf-8')).hexdigest()[:8]
+    return f'{CATEGORY_CACHE_PREFIX}:v{CATEGORY_PROMPT_VERSION}:{categories}:{OLLAMA_MODEL}'
+
+
+def category_cache_key(text: str) -> str:
+    """Cache key from the text with markup, punctuation, case and spacing normalized away."""
+    normalized = _WHITESPACE_RE.sub(' ', _NON_WORD_RE.sub(' ', _TAG_RE.sub(' ', text or '').lower())).strip()
+    return f'{category_cache_namespace()}:{hashlib.sha256(normalized.encode("utf-8")).hexdigest()}'
+
+
+def get_cached_categories(texts: Dict[Any, str]) -> Dict[Any, List[str]]:
+    if not texts:
+        return {}
+    article_ids = list(texts)
+    try:
+        values = redis_client.mget([category_cache_key(texts[article_id]) for article_id in article_ids])
+    except redis.RedisError as e:
+        debug_log(f'Category cache unavailable: {e}')
+        return {}
+    return {article_id: json.loads(value) for article_id, value in zip(article_ids, values) if value is not None}
+
+
+def set_cached_categories(texts: Dict[Any, str], results: Dict[Any, List[str]]):
+    if not results:
+        return
+    try:
+        pipe = redis_client.pipeline()
+        for article_id, categories in results.items():
+            pipe.setex(category_cache_key(texts[article_id]), CATEGORY_CACHE_TTL, json.dumps(categories))
+        pipe.execute()
+    except redis.RedisError as e:
+        debug_log(f'Failed to store categories in cache: {e}')
+
+
+def invalidate_stale_category_cache() -> int:
+    """
+    Delete cached answers from any other model or prompt version.
+    Run when the worker starts, so an OLLAMA_MODEL or CATEGORIES change drops the old entries explicitly.
+    """
+    current = f'{category_cache_namespace()}:'
+    deleted = 0
+    try:
+        for key in redis_client.scan_iter(match=f'{CATEGORY_CACHE_PREFIX}:*', count=1000):
+            if not key.startswith(current):
+                deleted += redis_client.delete(key)
+    except redis.RedisError as e:
+        debug_log(f'Failed to invalidate category cache: {e}')
+    if deleted:
+        debug_log(f'Removed {deleted} cached categorizations from other models or prompt versions')
+    return deleted
+
+
+def build_batch_prompt(texts: Dict[Any, str]) -> str:
+    articles = '\n\n'.join(f'Article {article_id}:\n{text}' for article_id, text in texts.items())
+    return (
+        f"For each of the following news articles, assign up to 3 categories from this list that are clearly and unambiguously relevant: "
+        f"[{', '.join(CATEGORIES)}]. Return only a JSON object that maps each article id to a JSON array of category names, "
+        f"for example {{\"12\": [\"World\", \"Politics\"], \"13\": []}}. "
+        f"Do not include any category unless it is obviously relevant. If none are clearly relevant, use an empty array.\n\n"
+        f"{articles}\n\nCategories:"
+    )
+
+
+def parse_batch_response(response: str) -> Dict[str, Any]:
+    try:
+        data = json.loads(response)
+    except json.JSONDecodeError:
+        match = re.search(r"\{.*\}", response, re.DOTALL)
+        if not match:
+            return {}
+        try:
+            data = json.loads(match.group(0))
+        except json.JSONDecodeError:
+            return {}
+    return data if isinstance(data, dict) else {}
+
+
+async def ollama_available() -> bool:
+    """
+    True while the breaker is closed. When it is half-open, one process
+    probes GET /api/tags and the breaker closes if Ollama answers.
+    """
+    if ollama_breaker.is_closed():
+        return True
+    if not ollama_breaker.try_probe():
+        return False
+    try:
+        res = await get_ollama_client().get(f"{os.getenv('OLLAMA_URL')}/api/tags", timeout=OLLAMA_PROBE_TIMEOUT)
+        healthy = res.status_code == 200
+        error = f'health probe returned {res.status_code}'
+    except Exception as e:
+        healthy, error = False, f'health probe failed: {e!r}'
+    if healthy:
+        ollama_breaker.record_success()
+    else:
+        ollama_breaker.record_failure(error)
+    return healthy
+
+
+async def categorize_batch(texts: Dict[Any, str], timeout: float = OLLAMA_TIMEOUT) -> Dict[Any, List[str]]:
+    """
+    Categorize up to OLLAMA_BATCH_SIZE articles with one Ollama call; returns
+    only the articles the model answered for. A timeout shorter than
+    OLLAMA_TIMEOUT comes from the caller's run budget, so hitting it does not
+    count against the breaker: Ollama may be healthy, just slow.
+    """
+    prompt_texts = {article_id: clean_text(text) for article_id, text in texts.items()}
+    answers: Dict[str, Any] = {}
+    try:
+        res = await get_ollama_client().post(
+            f"{os.getenv('OLLAMA_URL')}/api/generate",
+            json={
+                "model": OLLAMA_MODEL,
+                "prompt": build_batch_prompt(prompt_texts),
+                "format": "json",
+                "stream": False
+            },
+            timeout=timeout
+        )
+        if res.status_code == 200:
+            ollama_breaker.record_success()
+            answers = parse_batch_response(res.json().get('response', ''))
+        else:
+            debug_log(f'Ollama returned {res.status_code} for a batch of {len(texts)} articles')
+            ollama_breaker.record_failure(f'generate returned {res.status_code}')
+    except httpx.TimeoutException as e:
+        debug_log(f'Ollama batch of {len(texts)} articles timed out after {timeout:.0f}s: {e!r}')
+        if timeout >= OLLAMA_TIMEOUT:
+            ollama_breaker.record_failure(f'generate timed out: {e!r}')
+    except Exception as e:
+        debug_log(f'Ollama batch of {len(texts)} articles failed: {e}')
+        ollama_breaker.record_failure(f'generate failed: {e!r}')
+
+    results = {}
+    for article_id in texts:
+        categories = answers.get(str(article_id))
+        if isinstance(categories, list):
+            # Filter out any categories that aren't in our predefined list and limit to 3
+            results[article_id] = [cat for cat in categories if cat in CATEGORIES][:3]
+    return results
+
+
+def categorization(categories: List[str], source: str, confident: bool) -> Dict[str, Any]:
+    return {'categories': categories, 'source': source, 'confident': confident}
+
+
+async def categorize_texts(texts: Dict[Any, str]) -> Dict[Any, Dict[str, Any]]:
+    """
+    Categorize many articles, OLLAMA_BATCH_SIZE per prompt and OLLAMA_CONCURRENCY
+    prompts at a time. Cached answers are used first, then confident local
+    classifier answers; articles the model does not answer for fall back to the
+    classifier's best guess, or to keywords when no classifier is trained.
+    Ollama is skipped while its circuit breaker is open, and batches still
+    waiting when OLLAMA_RUN_BUDGET runs out are not sent.
+
+    Each result holds the 'categories', their 'source' (LABEL_MODEL for fresh
+    or cached Ollama answers, LABEL_CLASSIFIER or LABEL_KEYWORDS) and whether
+    the answer is 'confident', i.e. from Ollama or the classifier above
+    CLASSIFIER_CONFIDENCE rather than a fallback.
+    """
+    results = {
+        article_id: categorization(categories, LABEL_MODEL, True)
+        for article_id, categories in get_cached_categories(texts).items()
+    }
+    pending = {article_id: text for article_id, text in texts.items() if article_id not in results}
+    if results:
+        debug_log(f'Category cache hits: {len(results)} of {len(texts)}')
+    predictions = classify_texts(pending, CATEGORIES)
+    for article_id, prediction in predictions.items():
+        if prediction['confidence'] >= CLASSIFIER_CONFIDENCE:
+            results[article_id] = categorization(prediction['categories'], LABEL_CLASSIFIER, True)
+            del pending[article_id]
+    if predictions:
+        debug_log(f'Local classifier answered {len(predictions) - len(pending)} of {len(predictions)}')
+    items = list(pending.items())
+    batches = [dict(items[i:i + OLLAMA_BATCH_SIZE]) for i in range(0, len(items), OLLAMA_BATCH_SIZE)]
+    semaphore = asyncio.Semaphore(OLLAMA_CONCURRENCY)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + OLLAMA_RUN_BUDGET
+
+    async def run(batch):
+        async with semaphore:
+            remaining = deadline - loop.time()
+            # Re-checked per batch so failures earlier in this run stop the rest
+            if remaining <= 0 or not ollama_breaker.is_closed():
+                return {}
+            return await categorize_batch(batch, timeout=min(OLLAMA_TIMEOUT, remaining))
+
+    if batches and not await ollama_available():
+        debug_log(f'Ollama circuit breaker is open, skipping Ollama for {len(pending)} articles')
+        batches = []
+
+    answered = {}
+    for batch_result in await asyncio.gather(*(run(batch) for batch in batches)):
+        answered.update(batch_result)
+    set_cached_categories(pending, answered)
+    for article_id, categories in answered.items():
+        results[article_id] = categorization(categories, LABEL_MODEL, True)
+    for article_id, text in pending.items():
+        if article_id not in answered:
+            if article_id in predictions:
+                results[article_id] = categorization(predictions[article_id]['categories'], LABEL_CLASSIFIER, False)
+            else:
+                results[article_id] = categorization(keyword_based_categorization(text), LABEL_KEYWORDS, False)
+    return results
@@ -0,0 +1,275 @@
+"""
+Local linear category classifier trained from past Ollama labels.
+
+Articles are turned into hashed word and word-bigram features, and one
+logistic regression per category (category vs. the rest) is trained with
+full-batch Adagrad over all articles at once. Training only uses the
+categories Ollama assigned, as recorded by article_category.source, so
+the classifier never learns from its own or the keyword fallback's
+guesses. Articles form one sparse float32 (articles x features) matrix,
+so scoring is X @ W and the gradient X.T @ error; scoring a batch is
+cheap enough to run in-process ahead of the Ollama call. categorize_texts
+only sends articles the classifier is unsure about to the model, and
+uses the classifier's best guess when Ollama does not answer.
+
+The trained model is stored in Redis so every worker process picks up a
+retrain. Retrain with the train_category_classifier task, which also runs
+on a schedule, or from the command line:
+
+    python -m app.workers.classifier train
+"""
+
+import io
+import os
+import re
+import sys
+import time
+import zlib
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import redis
+import scipy.sparse as sp
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.models.database import Article, Category, article_category
+from app.workers import debug_log
+
+# Hashed feature space; larger means fewer collisions and a bigger model in Redis
+CLASSIFIER_FEATURES = int(os.environ.get('CLASSIFIER_FEATURES', 2 ** 18))
+# Every per-category decision must be at least this sure for the classifier's answer to be used without Ollama
+CLASSIFIER_CONFIDENCE = float(os.environ.get('CLASSIFIER_CONFIDENCE', 0.9))
+CLASSIFIER_MIN_TRAINING_ARTICLES = int(os.environ.get('CLASSIFIER_MIN_TRAINING_ARTICLES', 500))
+CLASSIFIER_MAX_TRAINING_ARTICLES = int(os.environ.get('CLASSIFIER_MAX_TRAINING_ARTICLES', 20000))
+# Seconds between checks for a newer model in Redis
+CLASSIFIER_RELOAD_INTERVAL = int(os.environ.get('CLASSIFIER_RELOAD_INTERVAL', 300))
+CLASSIFIER_EPOCHS = int(os.environ.get('CLASSIFIER_EPOCHS', 40))
+CLASSIFIER_LEARNING_RATE = 2.0
+CLASSIFIER_L2 = 1e-5
+
+# Values of article_category.source; only LABEL_MODEL rows are used for training
+LABEL_MODEL = 'model'
+LABEL_CLASSIFIER = 'classifier'
+LABEL_KEYWORDS = 'keywords'
+
+MODEL_KEY = 'classifier:model'
+MODEL_VERSION_KEY = 'classifier:model:version'
+
+_TAG_RE = re.compile(r'<[^>]+>')
+_WORD_RE = re.compile(r'\w+')
+
+# Model bytes are binary, so this client does not decode responses
+redis_client = redis.Redis.from_url(os.getenv('REDIS_URL', 'redis://redis:6379/0'))
+
+
+class CategoryClassifier:
+    """One-vs-rest logistic regression over hashed features: score = bias + weighted sum of feature weights."""
+
+    def __init__(self, categories: List[str], weights: np.ndarray, bias: np.ndarray):
+        self.categories = categories
+        self.weights = weights
+        self.bias = bias
+
+    @property
+    def num_features(self) -> int:
+        return self.weights.shape[0]
+
+    def probabilities(self, texts: List[str]) -> np.ndarray:
+        """(len(texts) x categories) probability that each category applies."""
+        return _sigmoid(_scores(self.weights, self.bias, _design(texts, self.num_features)))
+
+    def predict(self, texts: Dict[Any, str]) -> Dict[Any, Dict[str, Any]]:
+        """{id: {'categories': up to 3 names, most likely first, 'confidence': least sure per-category decision}}."""
+        if not texts:
+            return {}
+        article_ids = list(texts)
+        probs = self.probabilities([texts[article_id] for article_id in article_ids])
+        confidence = np.maximum(probs, 1.0 - probs).min(axis=1)
+        results = {}
+        for row, article_id in enumerate(article_ids):
+            order = np.argsort(-probs[row])
+            results[article_id] = {
+                'categories': [self.categories[i] for i in order[:3] if probs[row, i] >= 0.5],
+                'confidence': float(confidence[row]),
+            }
+        return results
+
+    def to_bytes(self) -> bytes:
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, categories=np.array(self.categories), weights=self.weights, bias=self.bias)
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'CategoryClassifier':
+        with np.load(io.BytesIO(data)) as archive:
+            return cls([str(name) for name in archive['categories']], archive['weights'], archive['bias'])
+
+
+def features(text: str, num_features: int = CLASSIFIER_FEATURES) -> np.ndarray:
+    """Distinct hashed indices of the words and word bigrams of text, HTML tags removed."""
+    words = _WORD_RE.findall(_TAG_RE.sub(' ', text or '').lower())
+    tokens = set(words)
+    tokens.update(f'{a} {b}' for a, b in zip(words, words[1:]))
+    # crc32 rather than hash(): string hashing is salted per process
+    return np.unique(np.fromiter((zlib.crc32(token.encode('utf-8')) for token in tokens), dtype=np.int64, count=len(tokens))
+                     % num_features)
+
+
+def _sigmoid(scores: np.ndarray) -> np.ndarray:
+    return 1.0 / (1.0 + np.exp(-np.clip(scores, -50, 50)))
+
+
+def _design(texts: List[str], num_features: int) -> sp.csr_matrix:
+    """Sparse float32 (texts x num_features) feature matrix; each row has unit length."""
+    indices = [features(text, num_features) for text in texts]
+    lengths = np.array([len(idx) for idx in indices], dtype=np.int64)
+    cols = np.concatenate(indices) if indices else np.zeros(0, dtype=np.int64)
+    values = np.repeat(1.0 / np.sqrt(np.maximum(lengths, 1)), lengths).astype(np.float32)
+    indptr = np.concatenate(([0], np.cumsum(lengths)))
+    return sp.csr_matrix((values, cols, indptr), shape=(len(texts), num_features))
+
+
+def _scores(weights: np.ndarray, bias: np.ndarray, design: sp.csr_matrix) -> np.ndarray:
+    return design @ weights + bias
+
+
+def train(texts: List[str], labels: List[List[str]], categories: List[str],
+          num_features: int = CLASSIFIER_FEATURES, epochs: int = CLASSIFIER_EPOCHS) -> CategoryClassifier:
+    """Fit one logistic regression per category with full-batch Adagrad, vectorized over all articles."""
+    column = {name: i for i, name in enumerate(categories)}
+    y = np.zeros((len(texts), len(categories)), dtype=np.float32)
+    for row, names in enumerate(labels):
+        for name in names:
+            if name in column:
+                y[row, column[name]] = 1.0
+
+    design = _design(texts, num_features)
+    design_t = design.T.tocsr()
+    weights = np.zeros((num_features, len(categories)), dtype=np.float32)
+    bias = np.zeros(len(categories), dtype=np.float32)
+    weights_sq = np.zeros_like(weights)
+    bias_sq = np.zeros_like(bias)
+    for _ in range(epochs):
+        error = _sigmoid(_scores(weights, bias, design)) - y
+        # Gradient of the mean log loss, scattered back onto the features of each article
+        weights_grad = design_t @ error / len(texts) + CLASSIFIER_L2 * weights
+        bias_grad = error.mean(axis=0)
+        weights_sq += weights_grad ** 2
+        bias_sq += bias_grad ** 2
+        weights -= CLASSIFIER_LEARNING_RATE * weights_grad / (np.sqrt(weights_sq) + 1e-8)
+        bias -= CLASSIFIER_LEARNING_RATE * bias_grad / (np.sqrt(bias_sq) + 1e-8)
+    return CategoryClassifier(categories, weights, bias)
+
+
+def load_training_data(db: Session, limit: int = CLASSIFIER_MAX_TRAINING_ARTICLES):
+    """Texts and category names of the newest `limit` articles categorized by Ollama."""
+    article_ids = (
+        select(article_category.c.article_id).where(article_category.c.source == LABEL_MODEL)
+        .distinct().order_by(article_category.c.article_id.desc()).limit(limit)
+    )
+    rows = db.execute(
+        select(Article.id, Article.title, Article.description, Category.name)
+        .join(article_category, article_category.c.article_id == Article.id)
+        .join(Category, Category.id == article_category.c.category_id)
+        .where(Article.id.in_(article_ids.scalar_subquery()), article_category.c.source == LABEL_MODEL)
+    ).all()
+    texts: Dict[int, str] = {}
+    labels: Dict[int, List[str]] = {}
+    for row in rows:
+        texts[row.id] = f'{row.title} {row.description}'
+        labels.setdefault(row.id, []).append(row.name)
+    return [texts[article_id] for article_id in texts], [labels[article_id] for article_id in texts]
+
+
+def evaluate(model: CategoryClassifier, texts: List[str], labels: List[List[str]],
+             threshold: float = CLASSIFIER_CONFIDENCE) -> Dict[str, float]:
+    """Share of articles the model would answer alone at threshold, and how often those answers match the labels."""
+    predictions = model.predict(dict(enumerate(texts)))
+    confident = [i for i, prediction in predictions.items() if prediction['confidence'] >= threshold]
+    agree = sum(set(predictions[i]['categories']) == set(labels[i]) for i in confident)
+    return {
+        'coverage': len(confident) / len(texts) if texts else 0.0,
+        'agreement': agree / len(confident) if confident else 0.0,
+    }
+
+
+def train_from_db(db: Session, categories: List[str]) -> Optional[Dict[str, Any]]:
+    """Train on Ollama's labels in article_category, report held-out coverage and agreement, and publish the model to Redis."""
+    texts, labels = load_training_data(db)
+    if len(texts) < CLASSIFIER_MIN_TRAINING_ARTICLES:
+        debug_log(f'Not training the category classifier: {len(texts)} labelled articles, '
+                  f'{CLASSIFIER_MIN_TRAINING_ARTICLES} needed')
+        return None
+    # Every tenth article is held out to estimate how the threshold performs; the model
+    # trained without them is the one published, so training runs only once
+    holdout = set(range(0, len(texts), 10))
+    model = train([t for i, t in enumerate(texts) if i not in holdout],
+                  [l for i, l in enumerate(labels) if i not in holdout], categories)
+    stats = evaluate(model, [texts[i] for i in sorted(holdout)], [labels[i] for i in sorted(holdout)])
+    save_model(model)
+    stats['articles'] = len(texts)
+    debug_log(f'Trained category classifier on {len(texts)} articles: '
+              f'{stats["coverage"]:.0%} answered locally at {CLASSIFIER_CONFIDENCE}, {stats["agreement"]:.0%} agreement')
+    return stats
+
+
+def save_model(model: CategoryClassifier):
+    pipe = redis_client.pipeline()
+    pipe.set(MODEL_KEY, model.to_bytes())
+    pipe.set(MODEL_VERSION_KEY, str(time.time()))
+    pipe.execute()
+
+
+_model: Optional[CategoryClassifier] = None
+_model_version: Optional[bytes] = None
+_model_checked_at = 0.0
+
+
+def get_model() -> Optional[CategoryClassifier]:
+    """The published model, reloaded when a retrain bumps its version; None until one has been trained."""
+    global _model, _model_version, _model_checked_at
+    now = time.monotonic()
+    if _model_checked_at and now - _model_checked_at < CLASSIFIER_RELOAD_INTERVAL:
+        return _model
+    _model_checked_at = now
+    try:
+        version = redis_client.get(MODEL_VERSION_KEY)
+        if version is not None and version != _model_version:
+            data = redis_client.get(MODEL_KEY)
+            if data is not None:
+                _model = CategoryClassifier.from_bytes(data)
+                _model_version = version
+                debug_log('Loaded category classifier')
+    except (redis.RedisError, ValueError, KeyError) as e:
+        debug_log(f'Category classifier unavailable: {e}')
+    return _model
+
+
+def classify_texts(texts: Dict[Any, str], categories: List[str]) -> Dict[Any, Dict[str, Any]]:
+    """Classifier predictions for texts, or {} when no model has been trained yet for this category list."""
+    model = get_model()
+    if model is None or not texts:
+        return {}
+    if model.categories != list(categories):
+        debug_log('Category classifier was trained on a different category list, retrain it')
+        return {}
+    return model.predict(texts)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] != ['train']:
+        print('usage: python -m app.workers.classifier train')
+        sys.exit(2)
+    from app.database import SessionLocal
+    from app.workers.categorizer import CATEGORIES
+    db = SessionLocal()
+    try:
+        result = train_from_db(db, CATEGORIES)
+    finally:
+        db.close()
+    if result is None:
+        print(f'Not enough labelled articles to train (need {CLASSIFIER_MIN_TRAINING_ARTICLES})')
+        sys.exit(1)
+    print(f"Trained on {result['articles']} articles; held out: {result['coverage']:.0%} answered locally, "
+          f"{result['agreement']:.0%} agreement with stored categories")
@@ -0,0 +1,221 @@
+"""
+SimHash fingerprints for cross-source near-duplicate detection.
+
+Each article gets a 64-bit SimHash of its title and the lead of its
+summary. Feeds syndicating the same story mostly differ in a publisher
+suffix on the title, a summary cut short, or a trailer such as "Read
+more", so the title counts TITLE_WEIGHT times (with its bigrams), the
+suffix is stripped, and only the first SUMMARY_WORDS words of the summary
+are used. Stopwords and markup are ignored.
+
+The hash is split into SIMHASH_MAX_DISTANCE + 1 bands covering all 64
+bits, stored in article_simhash_band. Two hashes within
+SIMHASH_MAX_DISTANCE bits of each other must then share at least one band
+exactly (pigeonhole), so candidates come from an indexed band lookup
+instead of a scan over every article. More bands mean narrower ones and
+more candidates per lookup, so the distance is capped at
+MAX_SIMHASH_DISTANCE.
+
+When the fingerprint or band layout changes, reindex_simhashes rehashes
+the stored articles once.
+"""
+
+import hashlib
+import os
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+
+import redis
+from sqlalchemy import delete, insert, select, tuple_
+from sqlalchemy.orm import Session
+
+from app.models.database import Article, article_simhash_band
+from app.workers import debug_log
+from app.workers.tokens import STOPWORDS
+
+SIMHASH_BITS = 64
+SIMHASH_MAX_DISTANCE = int(os.environ.get('WORKER_SIMHASH_MAX_DISTANCE', 5))
+# Bands narrower than 8 bits match too many articles to be worth indexing
+MAX_SIMHASH_DISTANCE = SIMHASH_BITS // 8 - 1
+if not 0 <= SIMHASH_MAX_DISTANCE <= MAX_SIMHASH_DISTANCE:
+    raise ValueError(f'WORKER_SIMHASH_MAX_DISTANCE must be between 0 and {MAX_SIMHASH_DISTANCE}, got {SIMHASH_MAX_DISTANCE}')
+SIMHASH_BANDS = SIMHASH_MAX_DISTANCE + 1
+# (shift, width) of each band; the first SIMHASH_BITS % SIMHASH_BANDS bands are one bit wider
+_WIDTHS = [SIMHASH_BITS // SIMHASH_BANDS + (band < SIMHASH_BITS % SIMHASH_BANDS) for band in range(SIMHASH_BANDS)]
+SIMHASH_BAND_LAYOUT = [(sum(_WIDTHS[:band]), width) for band, width in enumerate(_WIDTHS)]
+
+TITLE_WEIGHT = 4
+SUMMARY_WORDS = 16
+# Bump when the features change, so stored hashes are recomputed
+FINGERPRINT_VERSION = 2
+REINDEX_BATCH_SIZE = 1000
+LAYOUT_KEY = 'simhash:layout'
+LOCK_KEY = 'simhash:reindex'
+
+_TAG_RE = re.compile(r'<[^>]+>')
+_WORD_RE = re.compile(r'\w+')
+# A trailing " - Reuters", " | BBC News" and the like
+_PUBLISHER_SUFFIX_RE = re.compile(r'\s+[-|\u2013\u2014]\s+[^-|\u2013\u2014]{1,40}$')
+
+redis_client = redis.Redis.from_url(os.getenv('REDIS_URL', 'redis://redis:6379/0'), decode_responses=True)
+
+
+def _feature_hash(feature: str) -> int:
+    return int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def _words(text: str) -> List[str]:
+    return [word for word in _WORD_RE.findall(_TAG_RE.sub(' ', text).lower()) if len(word) > 1 and word not in STOPWORDS]
+
+
+def fingerprint_features(title: str, summary: str) -> Counter:
+    """Title words and bigrams weighted TITLE_WEIGHT, without a publisher suffix, plus the summary's first SUMMARY_WORDS words."""
+    title_words = _words(_PUBLISHER_SUFFIX_RE.sub('', title or ''))
+    features: Counter = Counter()
+    for feature in title_words + [f'{a} {b}' for a, b in zip(title_words, title_words[1:])]:
+        features[feature] += TITLE_WEIGHT
+    features.update(_words(summary or '')[:SUMMARY_WORDS])
+    return features
+
+
+def article_simhash(title: str, summary: str) -> int:
+    return simhash(fingerprint_features(title, summary))
+
+
+def simhash(features: Counter) -> int:
+    """Unsigned 64-bit SimHash of weighted features."""
+    weights = [0] * SIMHASH_BITS
+    for feature, count in features.items():
+        h = _feature_hash(feature)
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += count if h >> bit & 1 else -count
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+def to_signed(value: int) -> int:
+    """Map an unsigned 64-bit hash onto Postgres BIGINT."""
+    return value - (1 << SIMHASH_BITS) if value >= 1 << (SIMHASH_BITS - 1) else value
+
+
+def to_unsigned(value: int) -> int:
+    return value + (1 << SIMHASH_BITS) if value < 0 else value
+
+
+def bands(value: int) -> List[int]:
+    return [(value >> shift) & ((1 << width) - 1) for shift, width in SIMHASH_BAND_LAYOUT]
+
+
+def band_rows(hashes: Dict[int, int]) -> List[Dict[str, int]]:
+    return [
+        {'article_id': article_id, 'band': band, 'value': value}
+        for article_id, value_hash in hashes.items()
+        for band, value in enumerate(bands(value_hash))
+    ]
+
+
+def index_simhashes(db: Session, articles: Iterable[Article]) -> Dict[int, int]:
+    """Store the SimHash and band rows of the given articles and return {article_id: hash}; the caller commits."""
+    hashes = {}
+    for article in articles:
+        hashes[article.id] = article_simhash(article.title, article.description)
+        article.simhash = to_signed(hashes[article.id])
+    if hashes:
+        db.execute(delete(article_simhash_band).where(article_simhash_band.c.article_id.in_(list(hashes))))
+        db.execute(insert(article_simhash_band), band_rows(hashes))
+    return hashes
+
+
+def simhash_layout() -> str:
+    return f'{FINGERPRINT_VERSION}:{SIMHASH_BANDS}'
+
+
+def reindex_simhashes(db: Session) -> int:
+    """
+    Rehash every stored article if the fingerprint or band layout changed
+    since the last reindex. Existing duplicate links are kept. Returns the
+    number of articles rehashed.
+    """
+    if redis_client.get(LAYOUT_KEY) == simhash_layout():
+        return 0
+    lock = redis_client.lock(LOCK_KEY, timeout=600, blocking_timeout=0)
+    if not lock.acquire():
+        return 0
+    try:
+        indexed = 0
+        last_id = 0
+        while True:
+            articles = db.query(Article).filter(Article.id > last_id).order_by(Article.id).limit(REINDEX_BATCH_SIZE).all()
+            if not articles:
+                break
+            index_simhashes(db, articles)
+            db.commit()
+            indexed += len(articles)
+            last_id = articles[-1].id
+        redis_client.set(LAYOUT_KEY, simhash_layout())
+        debug_log(f'Rehashed {indexed} articles for SimHash layout {simhash_layout()}')
+        return indexed
+    finally:
+        try:
+            lock.release()
+        except redis.exceptions.LockError:
+            debug_log('SimHash reindex lock expired before it was released')
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+def link_near_duplicates(db: Session, article_ids: List[int]) -> Dict[int, Optional[int]]:
+    """
+    Fingerprint the given articles, refresh their band index rows and point
+    each one at the closest earlier canonical article within
+    SIMHASH_MAX_DISTANCE bits. Returns {article_id: canonical_id or None}.
+    """
+    if not article_ids:
+        return {}
+    articles = db.query(Article).filter(Article.id.in_(article_ids)).order_by(Article.id).all()
+    if not articles:
+        return {}
+    hashes = index_simhashes(db, articles)
+
+    # One indexed lookup for every band of every article on the page
+    keys = {(band, value) for value_hash in hashes.values() for band, value in enumerate(bands(value_hash))}
+    rows = db.execute(
+        select(Article.id, Article.simhash, Article.canonical_id, article_simhash_band.c.band, article_simhash_band.c.value)
+        .join(article_simhash_band, article_simhash_band.c.article_id == Article.id)
+        .where(tuple_(article_simhash_band.c.band, article_simhash_band.c.value).in_(list(keys)))
+    ).all()
+    candidates_by_band: Dict[tuple, Dict[int, int]] = {}
+    canonical_ids = set()
+    for row in rows:
+        if row.id in hashes:
+            continue
+        candidates_by_band.setdefault((row.band, row.value), {})[row.id] = to_unsigned(row.simhash)
+        if row.canonical_id is None:
+            canonical_ids.add(row.id)
+
+    result = {}
+    for article in articles:
+        value_hash = hashes[article.id]
+        candidates = {}
+        for key in enumerate(bands(value_hash)):
+            candidates.update(candidates_by_band.get(key, {}))
+        best, best_distance = None, SIMHASH_MAX_DISTANCE + 1
+        for candidate_id, candidate_hash in candidates.items():
+            if candidate_id >= article.id or candidate_id not in canonical_ids:
+                continue
+            distance = hamming_distance(value_hash, candidate_hash)
+            if distance < best_distance:
+                best, best_distance = candidate_id, distance
+        article.canonical_id = best
+        result[article.id] = best
+        if best is None:
+            # Later articles on the same page may be duplicates of this one
+            canonical_ids.add(article.id)
+            for key in enumerate(bands(value_hash)):
+                candidates_by_band.setdefault(key, {})[article.id] = value_hash
+        else:
+            debug_log(f'Article {article.id} is a near-duplicate of {best} (distance {best_distance})')
+    db.commit()
+    return result
@@ -0,0 +1,215 @@
+"""
+Concurrent enrichment of articles missing a description or thumbnail.
+
+A run shares one pooled httpx.AsyncClient for pages, image checks and
+thumbnail downloads. At most ENRICH_CONCURRENCY articles are enriched at
+once, and at most ENRICH_HOST_CONCURRENCY of them from the same host, on
+top of the per-host rate limit. Each article gets ENRICH_ARTICLE_TIMEOUT
+seconds, so one slow site cannot hold up the run, and no new article is
+started once ENRICH_RUN_BUDGET seconds have passed; the rest wait for the
+next run. Results are yielded as they finish, so the caller can commit
+them as it goes.
+
+Extraction runs in a thread, which the article timeout cannot interrupt,
+so pages are read only up to ENRICH_MAX_PAGE_BYTES; that bounds the work
+one page can cause however slowly trafilatura gets through it.
+"""
+
+import asyncio
+import codecs
+import os
+import re
+from collections import defaultdict
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlparse
+
+import httpx
+import trafilatura
+from lxml.html import HtmlElement
+from trafilatura.settings import use_config
+from trafilatura.utils import load_html
+
+from app.workers import debug_log
+from app.workers.images import is_probably_icon, is_small_image_async, save_thumbnail_async
+from app.workers.ratelimit import wait_for_host_async
+
+ENRICH_CONCURRENCY = int(os.environ.get('WORKER_ENRICH_CONCURRENCY', 20))
+ENRICH_HOST_CONCURRENCY = int(os.environ.get('WORKER_ENRICH_HOST_CONCURRENCY', 2))
+ENRICH_ARTICLE_TIMEOUT = float(os.environ.get('WORKER_ENRICH_ARTICLE_TIMEOUT', 30))
+# Kept below the task's soft time limit, so articles already started can finish
+ENRICH_RUN_BUDGET = float(os.environ.get('WORKER_ENRICH_RUN_BUDGET', 180))
+ENRICH_FETCH_TIMEOUT = 10.0
+# Pages are cut off after this many bytes; the head, with the lead image declarations, comes first
+ENRICH_MAX_PAGE_BYTES = int(os.environ.get('WORKER_ENRICH_MAX_PAGE_BYTES', 2097152))
+# Description length stored for articles whose feed entry had none
+DESCRIPTION_LENGTH = 1000
+
+USER_AGENT = 'Mozilla/5.0 (compatible; NewsFeed/1.0)'
+
+# Extraction runs in a worker thread, where trafilatura's SIGALRM timeout cannot be set and
+# wait_for cannot stop it; ENRICH_MAX_PAGE_BYTES bounds its input instead
+TRAFILATURA_CONFIG = use_config()
+TRAFILATURA_CONFIG.set('DEFAULT', 'EXTRACTION_TIMEOUT', '0')
+
+# Lead image declarations, most specific first. Publishers size these for link previews,
+# so they are used without probing their dimensions.
+META_IMAGE_XPATHS = [
+    '//meta[@property="og:image" or @property="og:image:url" or @property="og:image:secure_url"]/@content',
+    '//meta[@name="twitter:image" or @name="twitter:image:src" or @property="twitter:image"]/@content',
+    '//link[@rel="image_src"]/@href',
+]
+
+# <meta charset> or the http-equiv Content-Type form; browsers only look this far in
+META_CHARSET_RE = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([\w.:-]+)', re.IGNORECASE)
+META_CHARSET_BYTES = 1024
+
+
+async def fetch_page(client: httpx.AsyncClient, url: str) -> Optional[bytes]:
+    """The page's raw HTML, truncated to ENRICH_MAX_PAGE_BYTES; load_html detects its encoding."""
+    await wait_for_host_async(url)
+    async with client.stream('GET', url) as response:
+        if response.status_code != 200:
+            debug_log(f'Failed to fetch article {url}: HTTP {response.status_code}')
+            return None
+        body = bytearray()
+        async for chunk in response.aiter_bytes():
+            body += chunk
+            if len(body) >= ENRICH_MAX_PAGE_BYTES:
+                debug_log(f'Truncated article {url} at {ENRICH_MAX_PAGE_BYTES} bytes')
+                break
+        return bytes(body[:ENRICH_MAX_PAGE_BYTES])
+
+
+def image_urls(values: List[str], url: str) -> List[str]:
+    """Absolute URLs of the given src/href values, without inline images or repeats."""
+    images = []
+    for src in values:
+        src = src.strip()
+        if not src or src.startswith('data:'):
+            continue
+        try:
+            src = urljoin(url, src)
+        except ValueError:  # Malformed, such as an unclosed IPv6 host
+            continue
+        if src not in images:
+            images.append(src)
+    return images
+
+
+def page_images(tree: HtmlElement, url: str) -> Tuple[List[str], List[str]]:
+    """Lead images declared in the page metadata, then every <img> in document order."""
+    declared = image_urls([value for xpath in META_IMAGE_XPATHS for value in tree.xpath(xpath)], url)
+    return declared, image_urls(tree.xpath('//img/@src'), url)
+
+
+def declared_encoding(html: bytes) -> Optional[str]:
+    """The charset a <meta> tag at the top of the page declares, if Python knows it."""
+    match = META_CHARSET_RE.search(html[:META_CHARSET_BYTES])
+    if not match:
+        return None
+    try:
+        return codecs.lookup(match.group(1).decode('ascii')).name
+    except LookupError:
+        return None
+
+
+def extract_page(html: bytes, url: str) -> Tuple[Optional[str], List[str], List[str]]:
+    """
+    Parse a page once with lxml and use the tree for both image discovery and
+    trafilatura. Pages are decoded with the charset their <meta> tag declares,
+    else load_html guesses it. Returns the main text, the declared lead images
+    and the body images.
+    """
+    encoding = declared_encoding(html)
+    # The page may be cut off mid-character at ENRICH_MAX_PAGE_BYTES
+    tree = load_html(html.decode(encoding, errors='replace') if encoding else html)
+    if tree is None:
+        return None, [], []
+    # Images first: trafilatura prunes the tree it is given
+    declared, images = page_images(tree, url)
+    content = trafilatura.extract(tree, url=url, include_images=True, include_links=True, config=TRAFILATURA_CONFIG)
+    return content, declared, images
+
+
+async def find_image(client: httpx.AsyncClient, declared: List[str], candidates: List[str]) -> Optional[str]:
+    """The first declared lead image that is not an icon, else the first candidate that is neither an icon nor too small."""
+    for src in declared:
+        if not is_probably_icon(src):
+            return src
+    for src in candidates:
+        if is_probably_icon(src):
+            continue
+        if await is_small_image_async(client, src):
+            continue
+        return src
+    return None
+
+
+async def enrich_article(client: httpx.AsyncClient, article: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Fetch one article's page and return what it is missing: 'content' if it
+    needs a description, 'image_url' and 'thumbnail_url' if it needs a thumbnail.
+    """
+    result: Dict[str, Any] = {'id': article['id']}
+    html = await fetch_page(client, article['link'])
+    if not html:
+        return result
+    loop = asyncio.get_running_loop()
+    content, declared, images = await loop.run_in_executor(None, extract_page, html, article['link'])
+    if article['needs_description'] and content:
+        result['content'] = content
+    if article['needs_thumbnail']:
+        # A failed image lookup must not cost the article its description
+        try:
+            image_url = await find_image(client, declared, images)
+            if image_url:
+                thumbnail_url = await save_thumbnail_async(client, image_url, article['id'])
+                if thumbnail_url:
+                    result['image_url'] = image_url
+                    result['thumbnail_url'] = thumbnail_url
+        except Exception as e:
+            debug_log(f'Error finding an image for {article["link"]}: {e}')
+    return result
+
+
+async def enrich(articles: List[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Enrich articles concurrently, yielding enrich_article results as they
+    complete. Articles that fail, time out or are not started within the run
+    budget are skipped.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + ENRICH_RUN_BUDGET
+    semaphore = asyncio.Semaphore(ENRICH_CONCURRENCY)
+    host_semaphores = defaultdict(lambda: asyncio.Semaphore(ENRICH_HOST_CONCURRENCY))
+
+    async with httpx.AsyncClient(
+        timeout=ENRICH_FETCH_TIMEOUT,
+        follow_redirects=True,
+        headers={'User-Agent': USER_AGENT},
+        limits=httpx.Limits(max_connections=ENRICH_CONCURRENCY, max_keepalive_connections=ENRICH_CONCURRENCY)
+    ) as client:
+
+        async def run(article: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+            # Queue on the host first, so articles waiting for a busy site do not hold a global slot
+            async with host_semaphores[urlparse(article['link']).netloc.lower()]:
+                async with semaphore:
+                    if loop.time() >= deadline:
+                        return None
+                    try:
+                        return await asyncio.wait_for(enrich_article(client, article), ENRICH_ARTICLE_TIMEOUT)
+                    except asyncio.TimeoutError:
+                        debug_log(f'Timed out enriching article: {article["link"]}')
+                    except Exception as e:
+                        debug_log(f'Error enriching article {article["link"]}: {e}')
+                    return None
+
+        tasks = [asyncio.ensure_future(run(article)) for article in articles]
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                result = await next_result
+                if result is not None:
+                    yield result
+        finally:
+            for task in tasks:
+                task.cancel()
@@ -0,0 +1,194 @@
+"""
+Async client for the FreshRSS GReader API.
+
+One pooled httpx.AsyncClient is shared by the login call and every page
+request of a run, so continuation pages reuse the same keep-alive
+connection instead of paying a new TCP/TLS handshake each time. The auth
+token is cached in Redis so workers only repeat ClientLogin when it
+expires or FreshRSS rejects it.
+"""
+
+import asyncio
+import hashlib
+import os
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+import redis
+
+from app.workers import debug_log
+from app.workers.ratelimit import wait_for_host_async
+
+GREADER_TIMEOUT = float(os.environ.get('WORKER_FRESHRSS_TIMEOUT', 30))
+GREADER_MAX_CONNECTIONS = int(os.environ.get('WORKER_FRESHRSS_MAX_CONNECTIONS', 10))
+AUTH_TOKEN_TTL = int(os.environ.get('WORKER_FRESHRSS_AUTH_TOKEN_TTL', 86400))
+# FreshRSS is our own server, so it gets a higher per-host rate than scraped sites
+GREADER_RATE_LIMIT = float(os.environ.get('WORKER_FRESHRSS_RATE_LIMIT', 20))
+
+redis_client = redis.Redis.from_url(os.getenv('REDIS_URL', 'redis://redis:6379/0'), decode_responses=True)
+
+
+class GReaderError(Exception):
+    """Raised when the GReader API cannot be reached or rejects a request."""
+
+
+class GReaderClient:
+    """Pooled async GReader client, used as an async context manager."""
+
+    def __init__(self, api_url: str, username: str, password: str,
+                 timeout: float = GREADER_TIMEOUT, max_connections: int = GREADER_MAX_CONNECTIONS):
+        self.api_url = api_url.rstrip('/')
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.auth_token: Optional[str] = None
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @classmethod
+    def from_env(cls) -> Optional['GReaderClient']:
+        """Build a client from the FRESHRSS_GREADER_API_* variables, or None if they are not set."""
+        api_url = os.environ.get('FRESHRSS_GREADER_API_URL')
+        api_user = os.environ.get('FRESHRSS_GREADER_API_USER')
+        api_password = os.environ.get('FRESHRSS_GREADER_API_PASSWORD')
+        if not api_url or not api_user or not api_password:
+            return None
+        return cls(api_url, api_user, api_password)
+
+    async def __aenter__(self) -> 'GReaderClient':
+        self._client = httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections
+            )
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._client.aclose()
+        self._client = None
+
+    @property
+    def token_cache_key(self) -> str:
+        account = hashlib.sha256(f'{self.api_url}|{self.username}'.encode()).hexdigest()[:16]
+        return f'greader:auth_token:{account}'
+
+    async def get_auth_token(self, refresh: bool = False) -> str:
+        """Return the shared cached auth token, logging in only on a cache miss or when refresh is set."""
+        if not refresh:
+            try:
+                cached = redis_client.get(self.token_cache_key)
+            except redis.RedisError as e:
+                debug_log(f'GReader token cache unavailable: {e}')
+                cached = None
+            if cached:
+                self.auth_token = cached
+                return cached
+        token = await self.login()
+        try:
+            redis_client.setex(self.token_cache_key, AUTH_TOKEN_TTL, token)
+        except redis.RedisError as e:
+            debug_log(f'Failed to cache GReader token: {e}')
+        return token
+
+    def invalidate_auth_token(self):
+        self.auth_token = None
+        try:
+            redis_client.delete(self.token_cache_key)
+        except redis.RedisError as e:
+            debug_log(f'Failed to invalidate GReader token: {e}')
+
+    async def login(self) -> str:
+        """Fetch a GoogleLogin auth token with ClientLogin."""
+        await self._wait_for_rate_limit()
+        resp = await self._client.get(
+            f'{self.api_url}/accounts/ClientLogin',
+            params={'Email': self.username, 'Passwd': self.password}
+        )
+        if resp.status_code != 200:
+            debug_log(f'GReader API login error: {resp.status_code} {resp.text}')
+            raise GReaderError('Failed to get GReader Auth token')
+        for line in resp.text.splitlines():
+            if line.startswith('Auth='):
+                self.auth_token = line.split('=', 1)[1]
+                debug_log(f'GReader Auth token fetched: {self.auth_token[:8]}...')
+                return self.auth_token
+        debug_log(f'GReader API login response did not contain Auth token: {resp.text}')
+        raise GReaderError('Auth token not found in response')
+
+    async def get_json(self, path: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """GET a JSON document from /reader/api/0/<path>, logging in again once if the token is rejected."""
+        if self.auth_token is None:
+            await self.get_auth_token()
+        url = f'{self.api_url}/reader/api/0/{path}'
+        await self._wait_for_rate_limit()
+        resp = await self._client.get(url, params=params, headers=self._auth_headers())
+        if resp.status_code == 401:
+            debug_log('GReader token rejected, logging in again')
+            self.invalidate_auth_token()
+            await self.get_auth_token(refresh=True)
+            await self._wait_for_rate_limit()
+            resp = await self._client.get(url, params=params, headers=self._auth_headers())
+        if resp.status_code != 200:
+            debug_log(f'GReader API error: {resp.status_code} {resp.text}')
+            raise GReaderError(f'GReader API returned {resp.status_code} for {path}')
+        try:
+            return resp.json()
+        except ValueError as e:
+            debug_log(f'GReader API response (truncated): {resp.text[:200]}')
+            raise GReaderError(f'GReader API returned invalid JSON for {path}') from e
+
+    async def list_subscriptions(self) -> List[str]:
+        """Return the stream ids ('feed/<id>') of every subscription."""
+        data = await self.get_json('subscription/list', {'output': 'json'})
+        return [subscription['id'] for subscription in data.get('subscriptions', []) if subscription.get('id')]
+
+    async def _wait_for_rate_limit(self):
+        await wait_for_host_async(self.api_url, rate=GREADER_RATE_LIMIT, burst=self.max_connections)
+
+    def _auth_headers(self) -> Dict[str, str]:
+        return {'Authorization': f'GoogleLogin auth={self.auth_token}'}
+
+    async def _fetch_page(self, path: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        debug_log(f'Fetching from GReader API: {path} with params {params}')
+        try:
+            return await self.get_json(path, params)
+        except httpx.HTTPError as e:
+            raise GReaderError(f'GReader page fetch failed: {e}') from e
+
+    async def iter_stream(self, stream: str = 'reading-list', since: Optional[int] = None,
+                          batch_size: int = 100) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Yield pages of raw items from stream/contents/<stream>.
+
+        The request for page N+1 is started before page N is yielded, so the
+        caller's processing overlaps with the next download. Raises
+        GReaderError if a page cannot be fetched, after yielding the pages
+        that came before it.
+        """
+        path = f'stream/contents/{stream}'
+        params: Dict[str, Any] = {'output': 'json', 'n': batch_size}
+        if since is not None:
+            params['ot'] = since
+
+        pending = asyncio.ensure_future(self._fetch_page(path, params))
+        page_count = 0
+        try:
+            while pending is not None:
+                data = await pending
+                pending = None
+                items = data.get('items', [])
+                page_count += 1
+                debug_log(f'Fetched {len(items)} items from {stream} in page {page_count}')
+                if not items:
+                    break
+                continuation = data.get('continuation')
+                if continuation:
+                    pending = asyncio.ensure_future(self._fetch_page(path, {**params, 'c': continuation}))
+                else:
+                    debug_log(f'No continuation token, finished fetching {stream}')
+                yield items
+        finally:
+            if pending is not None:
+                pending.cancel()
@@ -0,0 +1,165 @@
+"""
+Image helpers shared by the thumbnail subtask and article enrichment.
+
+Every download goes through the per-host rate limiter. The async variants
+take the caller's pooled httpx.AsyncClient, so an enrichment run reuses
+its connections for pages and images alike; Pillow work runs in a thread.
+
+Image dimensions are probed from the first bytes only: a Range request
+asks for at most IMAGE_PROBE_MAX_BYTES, the chunks are fed to Pillow's
+incremental parser, and the download stops as soon as the header has
+been parsed, usually within the first kilobyte. Servers that ignore
+Range are cut off the same way. Results, including failures, are cached
+in Redis per URL for IMAGE_PROBE_CACHE_TTL seconds.
+"""
+
+import asyncio
+import hashlib
+import os
+from io import BytesIO
+from typing import Optional, Tuple
+
+import httpx
+import redis
+from PIL import Image, ImageFile
+
+from app.workers import debug_log
+from app.workers.ratelimit import wait_for_host, wait_for_host_async
+
+THUMB_SIZE = (96, 96)
+THUMBNAIL_DIR = os.environ.get('THUMBNAIL_DIR', '/thumbnails')
+MIN_IMAGE_WIDTH = 100
+MIN_IMAGE_HEIGHT = 100
+IMAGE_PROBE_MAX_BYTES = int(os.environ.get('WORKER_IMAGE_PROBE_MAX_BYTES', 65536))
+IMAGE_PROBE_CACHE_TTL = int(os.environ.get('WORKER_IMAGE_PROBE_CACHE_TTL', 604800))
+IMAGE_PROBE_TIMEOUT = 5.0
+
+redis_client = redis.Redis.from_url(os.getenv('REDIS_URL', 'redis://redis:6379/0'), decode_responses=True)
+
+
+def write_thumbnail(data: bytes, article_id: int) -> str:
+    """Save image bytes as the article's WebP thumbnail and return its URL path."""
+    img = Image.open(BytesIO(data))
+    img = img.convert('RGB')  # Ensure compatibility with webp
+    img.thumbnail(THUMB_SIZE)
+    os.makedirs(THUMBNAIL_DIR, exist_ok=True)
+    thumbnail_path = os.path.join(THUMBNAIL_DIR, f'{article_id}.webp')
+    img.save(thumbnail_path, 'WEBP')
+    debug_log(f'Saved thumbnail for article_id={article_id} to {thumbnail_path}')
+    return f'/thumbnails/{article_id}.webp'
+
+
+def save_thumbnail(image_url, article_id):
+    debug_log(f'Running save_thumbnail for article_id={article_id}, image_url={image_url}')
+    try:
+        wait_for_host(image_url)
+        response = httpx.get(image_url, timeout=10)
+        if response.status_code == 200:
+            return write_thumbnail(response.content, article_id)
+        debug_log(f'save_thumbnail failed for article_id={article_id}, HTTP status {response.status_code}')
+    except Exception as e:
+        debug_log(f'Failed to create thumbnail for {article_id}: {e}')
+    return None
+
+
+async def save_thumbnail_async(client: httpx.AsyncClient, image_url: str, article_id: int) -> Optional[str]:
+    try:
+        await wait_for_host_async(image_url)
+        response = await client.get(image_url)
+        if response.status_code == 200:
+            return await asyncio.get_running_loop().run_in_executor(None, write_thumbnail, response.content, article_id)
+        debug_log(f'save_thumbnail failed for article_id={article_id}, HTTP status {response.status_code}')
+    except Exception as e:
+        debug_log(f'Failed to create thumbnail for {article_id}: {e}')
+    return None
+
+
+def is_probably_icon(url):
+    """Return True if the image URL looks like an icon/logo/social icon."""
+    icon_keywords = ['icon', 'favicon', 'logo', 'twitter', 'facebook', 'linkedin', 'sprite', 'apple-touch']
+    url_lower = url.lower()
+    return any(keyword in url_lower for keyword in icon_keywords)
+
+
+def _probe_cache_key(url: str) -> str:
+    return f'image:size:{hashlib.sha256(url.encode()).hexdigest()}'
+
+
+def get_cached_size(url: str) -> Tuple[bool, Optional[Tuple[int, int]]]:
+    """(hit, size) for a probed URL; size is None if the probe could not read it."""
+    try:
+        value = redis_client.get(_probe_cache_key(url))
+    except redis.RedisError:
+        return False, None
+    if value is None:
+        return False, None
+    if not value:
+        return True, None
+    width, height = value.split('x')
+    return True, (int(width), int(height))
+
+
+def set_cached_size(url: str, size: Optional[Tuple[int, int]]):
+    try:
+        redis_client.setex(_probe_cache_key(url), IMAGE_PROBE_CACHE_TTL, f'{size[0]}x{size[1]}' if size else '')
+    except redis.RedisError:
+        pass
+
+
+class SizeParser:
+    """Feeds image bytes to Pillow's incremental parser until the dimensions are known."""
+
+    def __init__(self):
+        self.parser = ImageFile.Parser()
+        self.received = 0
+        self.size: Optional[Tuple[int, int]] = None
+
+    def feed(self, chunk: bytes) -> bool:
+        """Returns True once no more bytes are needed, because the size is known or the limit was reached."""
+        self.received += len(chunk)
+        try:
+            self.parser.feed(chunk)
+        except Exception:
+            # Not an image Pillow can read, such as an HTML error page
+            return True
+        if self.parser.image is not None:
+            self.size = self.parser.image.size
+            return True
+        return self.received >= IMAGE_PROBE_MAX_BYTES
+
+
+PROBE_HEADERS = {'Range': f'bytes=0-{IMAGE_PROBE_MAX_BYTES - 1}'}
+
+
+async def probe_image_size_async(client: httpx.AsyncClient, url: str) -> Optional[Tuple[int, int]]:
+    """(width, height) of the image at url, read from its first bytes, or None if it cannot be read."""
+    hit, size = get_cached_size(url)
+    if hit:
+        return size
+    try:
+        await wait_for_host_async(url)
+        async with client.stream('GET', url, headers=PROBE_HEADERS, timeout=IMAGE_PROBE_TIMEOUT) as response:
+            if response.status_code in (200, 206):
+                parser = SizeParser()
+                async for chunk in response.aiter_bytes():
+                    if parser.feed(chunk):
+                        break
+                size = parser.size
+    except Exception as e:
+        # Any failure, such as a URL the rate limiter cannot parse, leaves the size unknown.
+        # Not cached, the next run may reach the server
+        debug_log(f'Failed to probe image {url}: {e}')
+        return None
+    set_cached_size(url, size)
+    return size
+
+
+def is_small(size: Optional[Tuple[int, int]], min_width: int, min_height: int) -> bool:
+    # Images whose size cannot be read are not ruled out, as before probing existed
+    return size is not None and (size[0] < min_width or size[1] < min_height)
+
+
+async def is_small_image_async(client: httpx.AsyncClient, url: str,
+                               min_width: int = MIN_IMAGE_WIDTH, min_height: int = MIN_IMAGE_HEIGHT) -> bool:
+    """Return True if the image is smaller than the minimum dimensions."""
+    return is_small(await probe_image_size_async(client, url), min_width, min_height)
@@ -0,0 +1,138 @@
+"""
+MinHash-LSH index for related-article lookup.
+
+Each article gets a MINHASH_PERMUTATIONS-value MinHash signature of the
+word tokens of its title and description, computed once when it is
+stored and kept in Article.minhash. The signature is cut into
+MINHASH_BANDS bands whose hashes go into article_minhash_band; articles
+sharing any band are candidates. With the default 32 bands of 2 rows, a
+pair with Jaccard similarity 0.3 becomes a candidate with probability
+about 0.95, and one with similarity 0.1 with probability about 0.3.
+Candidates are then ranked by the similarity estimated from their full
+signatures, so lookups cost a handful of indexed band matches instead of
+a pass over the corpus.
+"""
+
+import hashlib
+import os
+import zlib
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+from sqlalchemy import delete, insert, select, tuple_
+from sqlalchemy.orm import Session
+
+from app.models.database import Article, article_minhash_band
+from app.workers import debug_log
+from app.workers.dedup import to_signed
+from app.workers.tokens import word_tokens
+
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = int(os.environ.get('WORKER_MINHASH_BANDS', 32))
+MINHASH_ROWS = MINHASH_PERMUTATIONS // MINHASH_BANDS
+BACKFILL_BATCH_SIZE = 1000
+
+# Universal hashing (a * x + b) mod p with a fixed seed, so every process computes the same signatures
+_PRIME = (1 << 31) - 1
+_rng = np.random.default_rng(20240601)
+_A = _rng.integers(1, _PRIME, MINHASH_PERMUTATIONS, dtype=np.int64)
+_B = _rng.integers(0, _PRIME, MINHASH_PERMUTATIONS, dtype=np.int64)
+
+
+def signature(text: str) -> Optional[np.ndarray]:
+    """MinHash signature (int32 array) of the tokens of text, or None if it has no tokens."""
+    tokens = word_tokens(text)
+    if not tokens:
+        return None
+    x = np.fromiter((zlib.crc32(token.encode('utf-8')) & 0x7FFFFFFF for token in tokens), dtype=np.int64, count=len(tokens))
+    return ((_A[:, None] * x[None, :] + _B[:, None]) % _PRIME).min(axis=1).astype(np.int32)
+
+
+def band_values(sig: np.ndarray) -> List[int]:
+    """Signed 64-bit hash of each band of a signature."""
+    return [
+        to_signed(int.from_bytes(hashlib.blake2b(band.tobytes(), digest_size=8).digest(), 'big'))
+        for band in sig.reshape(MINHASH_BANDS, MINHASH_ROWS)
+    ]
+
+
+def index_signatures(db: Session, article_ids: Iterable[int]):
+    """Compute and store signatures and band rows for the given articles; the caller commits."""
+    article_ids = list(article_ids)
+    if not article_ids:
+        return
+    articles = db.query(Article).filter(Article.id.in_(article_ids)).all()
+    db.execute(delete(article_minhash_band).where(article_minhash_band.c.article_id.in_(article_ids)))
+    rows = []
+    for article in articles:
+        sig = signature(f'{article.title} {article.description or ""}')
+        article.minhash = sig.tobytes() if sig is not None else None
+        if sig is not None:
+            rows.extend({'article_id': article.id, 'band': band, 'value': value}
+                        for band, value in enumerate(band_values(sig)))
+    if rows:
+        db.execute(insert(article_minhash_band), rows)
+    db.flush()
+
+
+def backfill_signatures(db: Session) -> int:
+    """Sign articles stored before signatures existed."""
+    indexed = 0
+    last_id = 0
+    while True:
+        article_ids = db.execute(
+            select(Article.id).where(Article.id > last_id, Article.minhash == None)
+            .order_by(Article.id).limit(BACKFILL_BATCH_SIZE)
+        ).scalars().all()
+        if not article_ids:
+            break
+        index_signatures(db, article_ids)
+        db.commit()
+        indexed += len(article_ids)
+        last_id = article_ids[-1]
+    if indexed:
+        debug_log(f'Computed MinHash signatures of {indexed} articles')
+    return indexed
+
+
+def find_related_articles(db: Session, article_ids: List[int], threshold: float, k: int) -> Dict[int, List[int]]:
+    """
+    For each article, the ids of up to k other articles whose estimated
+    Jaccard similarity is at least threshold, most similar first.
+    """
+    rows = db.execute(select(Article.id, Article.minhash).where(Article.id.in_(article_ids))).all()
+    signatures = {row.id: np.frombuffer(row.minhash, dtype=np.int32) for row in rows if row.minhash}
+    related: Dict[int, List[int]] = {row.id: [] for row in rows}
+    if not signatures:
+        return related
+
+    bands = {article_id: band_values(sig) for article_id, sig in signatures.items()}
+    keys = {(band, value) for values in bands.values() for band, value in enumerate(values)}
+    candidates_by_key: Dict[tuple, set] = {}
+    candidate_signatures: Dict[int, np.ndarray] = {}
+    for row in db.execute(
+        select(article_minhash_band.c.band, article_minhash_band.c.value, Article.id, Article.minhash)
+        .join(Article, Article.id == article_minhash_band.c.article_id)
+        .where(tuple_(article_minhash_band.c.band, article_minhash_band.c.value).in_(list(keys)))
+    ):
+        candidates_by_key.setdefault((row.band, row.value), set()).add(row.id)
+        candidate_signatures[row.id] = np.frombuffer(row.minhash, dtype=np.int32)
+
+    for article_id, sig in signatures.items():
+        candidate_ids = set()
+        for key in enumerate(bands[article_id]):
+            candidate_ids |= candidates_by_key.get(key, set())
+        candidate_ids.discard(article_id)
+        if not candidate_ids:
+            continue
+        ids = np.fromiter(candidate_ids, dtype=np.int64, count=len(candidate_ids))
+        matrix = np.stack([candidate_signatures[candidate_id] for candidate_id in ids])
+        scores = (matrix == sig).mean(axis=1)
+        keep = scores >= threshold
+        ids, scores = ids[keep], scores[keep]
+        if len(ids) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            ids, scores = ids[top], scores[top]
+        order = np.lexsort((-ids, -scores))
+        related[article_id] = [int(candidate_id) for candidate_id in ids[order]]
+    return related
@@ -0,0 +1,68 @@
+"""
+Per-host token-bucket rate limiter shared by all worker processes.
+
+Buckets live in Redis and are updated by a Lua script, so every worker
+process draws from the same bucket for a host. A request that finds the
+bucket empty reserves the next token and is told how long to wait, so
+callers sleep exactly as long as needed instead of a fixed interval.
+Requests to different hosts never wait on each other.
+"""
+
+import asyncio
+import os
+import time
+from typing import Optional
+from urllib.parse import urlparse
+
+import redis
+
+from app.workers import debug_log
+
+HOST_RATE_LIMIT = float(os.environ.get('WORKER_HOST_RATE_LIMIT', 1))  # Requests per second per host
+HOST_BURST = int(os.environ.get('WORKER_HOST_BURST', 2))
+
+redis_client = redis.Redis.from_url(os.getenv('REDIS_URL', 'redis://redis:6379/0'))
+
+# KEYS[1] bucket key; ARGV[1] rate per second; ARGV[2] burst size. Returns seconds to wait.
+_TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + (now - ts) * rate) - 1
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 60)
+if tokens >= 0 then
+    return '0'
+end
+return tostring(-tokens / rate)
+"""
+_token_bucket = redis_client.register_script(_TOKEN_BUCKET_SCRIPT)
+
+
+def reserve(url: str, rate: Optional[float] = None, burst: Optional[int] = None) -> float:
+    """Take a token from the bucket of url's host and return how many seconds to wait before using it."""
+    host = urlparse(url).netloc.lower()
+    if not host:
+        return 0.0
+    try:
+        return float(_token_bucket(keys=[f'ratelimit:host:{host}'], args=[rate or HOST_RATE_LIMIT, burst or HOST_BURST]))
+    except redis.RedisError as e:
+        # Fail open: an unavailable Redis should not stop ingestion
+        debug_log(f'Rate limiter unavailable for {host}: {e}')
+        return 0.0
+
+
+def wait_for_host(url: str, rate: Optional[float] = None, burst: Optional[int] = None):
+    delay = reserve(url, rate, burst)
+    if delay > 0:
+        time.sleep(delay)
+
+
+async def wait_for_host_async(url: str, rate: Optional[float] = None, burst: Optional[int] = None):
+    delay = reserve(url, rate, burst)
+    if delay > 0:
+        await asyncio.sleep(delay)
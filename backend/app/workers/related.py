@@ -0,0 +1,191 @@
+"""
+Related-article lookup.
+
+RELATED_ENGINE picks the engine, and only its index is maintained:
+
+- 'tokens': an inverted index over normalized title tokens
+  (article_title_token). Candidates are articles sharing a token, scored
+  by Jaccard similarity of the title token sets.
+- 'minhash': MinHash-LSH signatures of title and description
+  (app.workers.minhash). Candidates share an LSH band and are ranked by
+  estimated Jaccard similarity.
+- 'tfidf' (default, app.workers.tfidf): a sparse TF-IDF matrix of the
+  corpus in Redis, ranked by cosine similarity.
+
+The database indexes are filled when an article is upserted and removed
+with it by ON DELETE CASCADE when it is purged; backfill_indexes fills
+them for articles stored while another engine was selected. The TF-IDF
+matrix is updated as pages are ingested and pruned after each purge.
+
+Either way the best MAX_RELATED articles at or above SIMILARITY_THRESHOLD
+are returned, most similar first.
+"""
+
+import os
+from typing import Dict, Iterable, List, Set
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import Session
+
+from app.models.database import Article, article_related, article_title_token
+from app.workers import debug_log, minhash, tfidf
+from app.workers.tokens import word_tokens
+
+RELATED_ENGINE = os.environ.get('WORKER_RELATED_ENGINE', 'tfidf')
+SIMILARITY_THRESHOLD = float(os.environ.get('WORKER_RELATED_SIMILARITY_THRESHOLD', 0.3))
+MAX_RELATED = int(os.environ.get('WORKER_RELATED_MAX_RELATED', 3))
+# Articles indexed per batch when backfilling articles stored before the index existed
+BACKFILL_BATCH_SIZE = 1000
+
+
+def title_tokens(title: str) -> Set[str]:
+    return {token[:64] for token in word_tokens(title)}
+
+
+def index_title_tokens(db: Session, article_ids: Iterable[int]):
+    """Replace the token rows of the given articles; the caller commits."""
+    article_ids = list(article_ids)
+    if not article_ids:
+        return
+    rows = db.execute(select(Article.id, Article.title).where(Article.id.in_(article_ids))).all()
+    db.execute(delete(article_title_token).where(article_title_token.c.article_id.in_(article_ids)))
+    values = [{'token': token, 'article_id': row.id} for row in rows for token in title_tokens(row.title)]
+    if values:
+        db.execute(insert(article_title_token), values)
+
+
+def backfill_title_tokens(db: Session) -> int:
+    """Index articles that have no token rows yet, such as those stored before the index existed."""
+    indexed = 0
+    last_id = 0
+    while True:
+        # Keyset walk, since titles with no indexable tokens never get rows and would be selected again
+        article_ids = db.execute(
+            select(Article.id)
+            .where(Article.id > last_id)
+            .where(~select(article_title_token.c.article_id).where(article_title_token.c.article_id == Article.id).exists())
+            .order_by(Article.id)
+            .limit(BACKFILL_BATCH_SIZE)
+        ).scalars().all()
+        if not article_ids:
+            break
+        index_title_tokens(db, article_ids)
+        db.commit()
+        indexed += len(article_ids)
+        last_id = article_ids[-1]
+    if indexed:
+        debug_log(f'Indexed title tokens of {indexed} articles')
+    return indexed
+
+
+def jaccard(shared: int, size_a: int, size_b: int) -> float:
+    union = size_a + size_b - shared
+    return shared / union if union > 0 else 0.0
+
+
+def index_articles(db: Session, article_ids: Iterable[int]):
+    """Refresh RELATED_ENGINE's index for the given articles; the caller commits the database ones."""
+    article_ids = list(article_ids)
+    if RELATED_ENGINE == 'tfidf':
+        if article_ids:
+            tfidf.update_index(db, article_ids)
+    elif RELATED_ENGINE == 'minhash':
+        minhash.index_signatures(db, article_ids)
+    else:
+        index_title_tokens(db, article_ids)
+
+
+def backfill_indexes(db: Session) -> int:
+    """Index articles missing from RELATED_ENGINE's database index; the TF-IDF matrix is built on first use instead."""
+    if RELATED_ENGINE == 'tfidf':
+        return 0
+    if RELATED_ENGINE == 'minhash':
+        return minhash.backfill_signatures(db)
+    return backfill_title_tokens(db)
+
+
+def prune_index(db: Session):
+    """Drop purged articles from RELATED_ENGINE's index, once they are deleted and committed."""
+    if RELATED_ENGINE == 'tfidf':
+        tfidf.prune_index(db)
+
+
+def find_related_articles(db: Session, article_ids: List[int]) -> Dict[int, List[int]]:
+    """For each article, the ids of up to MAX_RELATED related articles from RELATED_ENGINE, most similar first."""
+    if RELATED_ENGINE == 'tfidf':
+        return tfidf.find_related_articles(db, article_ids, SIMILARITY_THRESHOLD, MAX_RELATED)
+    if RELATED_ENGINE == 'minhash':
+        return minhash.find_related_articles(db, article_ids, SIMILARITY_THRESHOLD, MAX_RELATED)
+    return find_related_by_tokens(db, article_ids, SIMILARITY_THRESHOLD, MAX_RELATED)
+
+
+def find_related_by_tokens(db: Session, article_ids: List[int], threshold: float, k: int) -> Dict[int, List[int]]:
+    """
+    For each article, the ids of up to k other articles whose title tokens
+    have a Jaccard similarity of at least threshold, most similar first.
+    """
+    rows = db.execute(select(Article.id, Article.title).where(Article.id.in_(article_ids))).all()
+    tokens = {row.id: title_tokens(row.title) for row in rows}
+    all_tokens = set().union(*tokens.values()) if tokens else set()
+    if not all_tokens:
+        return {article_id: [] for article_id in tokens}
+
+    postings: Dict[str, List[int]] = {}
+    for row in db.execute(
+        select(article_title_token.c.token, article_title_token.c.article_id)
+        .where(article_title_token.c.token.in_(all_tokens))
+    ):
+        postings.setdefault(row.token, []).append(row.article_id)
+
+    shared_counts: Dict[int, Dict[int, int]] = {}
+    for article_id, article_tokens in tokens.items():
+        counts = shared_counts.setdefault(article_id, {})
+        for token in article_tokens:
+            for candidate_id in postings.get(token, ()):
+                if candidate_id != article_id:
+                    counts[candidate_id] = counts.get(candidate_id, 0) + 1
+
+    candidate_ids = {candidate_id for counts in shared_counts.values() for candidate_id in counts}
+    sizes = dict(db.execute(
+        select(article_title_token.c.article_id, func.count())
+        .where(article_title_token.c.article_id.in_(candidate_ids))
+        .group_by(article_title_token.c.article_id)
+    ).all()) if candidate_ids else {}
+
+    related = {}
+    for article_id, counts in shared_counts.items():
+        scored = [
+            (jaccard(shared, len(tokens[article_id]), sizes.get(candidate_id, shared)), candidate_id)
+            for candidate_id, shared in counts.items()
+        ]
+        scored = [item for item in scored if item[0] >= threshold]
+        scored.sort(key=lambda item: (-item[0], -item[1]))
+        related[article_id] = [candidate_id for _, candidate_id in scored[:k]]
+    return related
+
+
+def drop_purged(db: Session, related: Dict[int, List[int]]) -> Dict[int, List[int]]:
+    """
+    {article_id: related ids} without articles purged since the links were
+    found, such as TF-IDF rows not pruned yet, which would fail the foreign keys.
+    """
+    article_ids = set(related) | {related_id for related_ids in related.values() for related_id in related_ids}
+    if not article_ids:
+        return {}
+    stored = set(db.execute(select(Article.id).where(Article.id.in_(article_ids))).scalars())
+    return {
+        article_id: [related_id for related_id in related_ids if related_id in stored]
+        for article_id, related_ids in related.items() if article_id in stored
+    }
+
+
+def link_related(db: Session, related: Dict[int, List[int]]) -> int:
+    """Insert article_related rows for {article_id: related ids} still stored in one statement; the caller commits."""
+    rows = [
+        {'article_id': article_id, 'related_article_id': related_id}
+        for article_id, related_ids in drop_purged(db, related).items()
+        for related_id in related_ids
+    ]
+    if rows:
+        db.execute(insert(article_related), rows)
+    return len(rows)
@@ -0,0 +1,162 @@
+"""
+Story clustering over related-article links.
+
+Every related link is an edge between two articles, and a story is a
+connected component of those edges, kept in Article.story_id. Clusters
+are maintained incrementally as links are added: the stories of the
+articles at both ends are unioned with a union-find (union by size,
+path halving), the largest existing story absorbs the others, and
+articles not yet in a story join it. Components may not grow past
+STORY_MAX_ARTICLES, so a chain of loosely related links cannot swallow
+the whole corpus.
+
+Every change takes a Redis lock, since relate tasks for different chunks
+run in parallel and may merge the same stories.
+"""
+
+import os
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+import redis
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.orm import Session
+
+from app.models.database import Article, Story, article_related
+from app.workers import debug_log
+
+STORY_MAX_ARTICLES = int(os.environ.get('WORKER_STORY_MAX_ARTICLES', 200))
+STORY_LOCK_TIMEOUT = 60
+LOCK_KEY = 'stories:lock'
+
+redis_client = redis.Redis.from_url(os.getenv('REDIS_URL', 'redis://redis:6379/0'))
+
+
+class UnionFind:
+    """Disjoint sets of hashable elements, each with a starting size."""
+
+    def __init__(self, sizes: Dict[Hashable, int]):
+        self.parent = {element: element for element in sizes}
+        self.size = dict(sizes)
+
+    def find(self, element: Hashable) -> Hashable:
+        parent = self.parent
+        while parent[element] != element:
+            parent[element] = parent[parent[element]]
+            element = parent[element]
+        return element
+
+    def union(self, a: Hashable, b: Hashable, max_size: int) -> bool:
+        """Join the sets of a and b unless the result would exceed max_size."""
+        a, b = self.find(a), self.find(b)
+        if a == b or self.size[a] + self.size[b] > max_size:
+            return False
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+        return True
+
+    def groups(self) -> List[List[Hashable]]:
+        """Sets with more than one element."""
+        groups: Dict[Hashable, List[Hashable]] = {}
+        for element in self.parent:
+            groups.setdefault(self.find(element), []).append(element)
+        return [group for group in groups.values() if len(group) > 1]
+
+
+@contextmanager
+def story_lock():
+    lock = redis_client.lock(LOCK_KEY, timeout=STORY_LOCK_TIMEOUT, blocking_timeout=STORY_LOCK_TIMEOUT)
+    if not lock.acquire():
+        raise TimeoutError('Timed out waiting for the story lock')
+    try:
+        yield
+    finally:
+        try:
+            lock.release()
+        except redis.exceptions.LockError:
+            debug_log('Story lock expired before it was released')
+
+
+def related_edges(related: Dict[int, List[int]]) -> List[Tuple[int, int]]:
+    return [(article_id, related_id) for article_id, related_ids in related.items() for related_id in related_ids]
+
+
+def create_stories(db: Session, count: int) -> List[int]:
+    if not count:
+        return []
+    now = datetime.utcnow()
+    return list(db.scalars(insert(Story).returning(Story.id), [{'created_at': now, 'updated_at': now}] * count))
+
+
+def assign_stories(db: Session, edges: Iterable[Tuple[int, int]],
+                   story_of: Optional[Dict[int, Optional[int]]] = None) -> int:
+    """
+    Union the stories joined by the given article links; the caller holds
+    story_lock and commits. story_of maps article ids to their current story
+    and is loaded for the linked articles if not given. Returns the number
+    of stories created or grown.
+    """
+    edges = list(edges)
+    article_ids = {article_id for edge in edges for article_id in edge}
+    if not article_ids:
+        return 0
+    if story_of is None:
+        story_of = dict(db.execute(
+            select(Article.id, Article.story_id).where(Article.id.in_(article_ids))
+        ).all())
+    story_ids = {story_id for story_id in story_of.values() if story_id is not None}
+    sizes: Dict[Hashable, int] = {('story', story_id): 0 for story_id in story_ids}
+    if story_ids:
+        sizes.update({('story', story_id): count for story_id, count in db.execute(
+            select(Article.story_id, func.count()).where(Article.story_id.in_(story_ids)).group_by(Article.story_id)
+        ).all()})
+
+    def element(article_id: int) -> Hashable:
+        story_id = story_of.get(article_id)
+        return ('story', story_id) if story_id is not None else ('article', article_id)
+
+    sizes.update({('article', article_id): 1 for article_id in story_of if story_of[article_id] is None})
+    sets = UnionFind(sizes)
+    for a, b in edges:
+        # Links may point at articles purged since they were found
+        if a in story_of and b in story_of:
+            sets.union(element(a), element(b), STORY_MAX_ARTICLES)
+
+    groups = sets.groups()
+    new_story_ids = iter(create_stories(db, sum(
+        1 for group in groups if not any(kind == 'story' for kind, _ in group)
+    )))
+    assignments, targets = [], []
+    for group in groups:
+        stories = sorted((sizes[item], item[1]) for item in group if item[0] == 'story')
+        target = stories[-1][1] if stories else next(new_story_ids)
+        absorbed = [story_id for _, story_id in stories[:-1]]
+        if absorbed:
+            db.execute(update(Article).where(Article.story_id.in_(absorbed)).values(story_id=target))
+            db.execute(delete(Story).where(Story.id.in_(absorbed)))
+        assignments.extend({'id': article_id, 'story_id': target} for kind, article_id in group if kind == 'article')
+        targets.append(target)
+    if targets:
+        db.execute(update(Story).where(Story.id.in_(targets)).values(updated_at=datetime.utcnow()))
+    if assignments:
+        db.execute(update(Article), assignments)
+    return len(groups)
+
+
+def rebuild_stories(db: Session) -> int:
+    """Recompute every story from article_related, for use after the links themselves were rebuilt; the caller commits."""
+    db.execute(update(Article).where(Article.story_id != None).values(story_id=None))
+    db.execute(delete(Story))
+    edges = db.execute(select(article_related.c.article_id, article_related.c.related_article_id)).all()
+    story_of = {article_id: None for article_id in db.execute(select(Article.id)).scalars()}
+    stories = assign_stories(db, edges, story_of)
+    debug_log(f'Clustered articles into {stories} stories')
+    return stories
+
+
+def delete_empty_stories(db: Session):
+    """Drop stories left without articles, such as after a purge; the caller commits."""
+    db.execute(delete(Story).where(~select(Article.id).where(Article.story_id == Story.id).exists()))
@@ -1,33 +1,49 @@
-from celery import Celery
+from celery import Celery, chord, group
 import os
 import httpx
 import asyncio
-from PIL import Image
-import io
 import redis
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import time
-import re
 import json
+import hashlib
+import shutil
+import uuid
 from celery.schedules import crontab
+from celery.signals import worker_process_init, worker_ready
+from sqlalchemy import delete, func, insert, select, update
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from app.freshrss_api_ext import FreshRSSAPIExt
 from loguru import logger
-import requests
-from bs4 import BeautifulSoup
-from urllib.parse import urlparse
-import trafilatura  # For better article extraction
 import pytz
-from io import BytesIO
 
-from app.database import SessionLocal
-from app.models.database import Article, Category
+from app.database import SessionLocal, engine
+from app.models.database import Article, Category, article_category, article_related, article_related_staging
+from app.workers import debug_log
+from app.workers.greader import GReaderClient, GReaderError
+from app.workers.dedup import link_near_duplicates, reindex_simhashes
+from app.workers.related import (
+    backfill_indexes, drop_purged, find_related_articles, index_articles, link_related, prune_index
+)
+from app.workers.stories import (
+    assign_stories, delete_empty_stories, rebuild_stories, related_edges, story_lock
+)
+from app.workers.enrichment import DESCRIPTION_LENGTH, enrich
+from app.workers.images import THUMBNAIL_DIR, save_thumbnail
+from app.workers.classifier import train_from_db
+from app.workers.breaker import BREAKER_COOLDOWN
+from app.workers.categorizer import (
+    CATEGORIES, categorize_texts, invalidate_stale_category_cache, ollama_available, ollama_breaker
+)
 
 # Initialize Celery with optimized settings
 celery_app = Celery('newsfeed', 
     broker=os.getenv('REDIS_URL', 'redis://redis:6379/0'),
+    backend=os.getenv('REDIS_URL', 'redis://redis:6379/0'),  # Needed for the chords in the article pipeline
+    result_expires=int(os.environ.get('WORKER_RESULT_EXPIRES', 3600)),
     broker_connection_retry_on_startup=True,
     worker_prefetch_multiplier=int(os.environ.get('WORKER_PREFETCH_MULTIPLIER', 1)),  # Process one task at a time
     task_acks_late=True,  # Only acknowledge task after completion
@@ -38,50 +54,50 @@ celery_app = Celery('newsfeed',
     worker_max_memory_per_child=int(os.environ.get('WORKER_MAX_MEMORY_PER_CHILD', 200000))  # Restart worker after 200MB memory usage
 )
 
-# Initialize Redis (only for Celery broker)
+# Initialize Redis (Celery broker, result backend and ingestion state)
 redis_client = redis.Redis.from_url(os.getenv('REDIS_URL', 'redis://redis:6379/0'))
 
 # Constants
-THUMB_SIZE = (96, 96)
-CATEGORIES = [
-    'Politics', 'US', 'World', 'Sports', 'Technology', 
-    'Entertainment', 'Science', 'Health', 'Business'
-]
-
 # Fetch limit, concurrency, and days from environment
 FETCH_LIMIT = int(os.environ.get('WORKER_FRESHRSS_FETCH_LIMIT', 100))
 CONCURRENT_FETCH_TASKS = int(os.environ.get('WORKER_CONCURRENT_FRESHRSS_FETCH_TASKS', 1))
 FETCH_DAYS = int(os.environ.get('WORKER_FRESHRSS_FETCH_DAYS', 3))
 PURGE_NUM_DAYS_TO_KEEP = int(os.environ.get('WORKER_FRESHRSS_PURGE_NUM_DAYS_TO_KEEP', 7))
+# Minutes between full FETCH_DAYS window reads; runs in between only fetch past the watermark
+FULL_SYNC_INTERVAL = int(os.environ.get('WORKER_FRESHRSS_FULL_SYNC_INTERVAL', 1440))
+# Seconds re-read behind the watermark to catch items crawled while the last run was paging
+WATERMARK_OVERLAP = int(os.environ.get('WORKER_FRESHRSS_WATERMARK_OVERLAP', 300))
 fetch_semaphore = asyncio.Semaphore(CONCURRENT_FETCH_TASKS)
+# 'reading-list' reads one combined stream; 'feeds' reads every subscription concurrently
+FETCH_MODE = os.environ.get('WORKER_FRESHRSS_FETCH_MODE', 'reading-list')
+
+# Articles per categorize/relate/thumbnail subtask
+PIPELINE_CHUNK_SIZE = int(os.environ.get('WORKER_PIPELINE_CHUNK_SIZE', 20))
+# Minutes after which an unchanged but still unprocessed article is dispatched again
+PIPELINE_RETRY_AFTER = int(os.environ.get('WORKER_PIPELINE_RETRY_AFTER', 60))
+# Most stuck articles dispatched again by one redispatch_unprocessed_articles run
+PIPELINE_SWEEP_LIMIT = int(os.environ.get('WORKER_PIPELINE_SWEEP_LIMIT', 1000))
+# Articles recategorized per rebuild_categories task; a slow Ollama (about 30s per batch at the default
+# batch size and concurrency) gets through this many within OLLAMA_RUN_BUDGET
+CATEGORY_REBUILD_CHUNK_SIZE = int(os.environ.get('WORKER_CATEGORY_REBUILD_CHUNK_SIZE', 64))
+# Times in a row an article may go unanswered before the rebuild skips it and keeps its categories
+CATEGORY_REBUILD_MAX_ATTEMPTS = int(os.environ.get('WORKER_CATEGORY_REBUILD_MAX_ATTEMPTS', 3))
+CATEGORY_REBUILD_KEY = 'rebuild:categories'
+# Articles related per rebuild_related_chunk task
+RELATED_REBUILD_CHUNK_SIZE = int(os.environ.get('WORKER_RELATED_REBUILD_CHUNK_SIZE', 500))
+RELATED_REBUILD_KEY = 'rebuild:related'
+# Enriched articles stored per commit, so a run killed by its time limit keeps what it finished
+ENRICH_COMMIT_BATCH_SIZE = int(os.environ.get('WORKER_ENRICH_COMMIT_BATCH_SIZE', 20))
 
 # Task intervals in minutes
 PROCESS_ARTICLES_INTERVAL = int(os.environ.get('WORKER_PROCESS_ARTICLES_INTERVAL', 15))
 PURGE_OLD_ARTICLES_INTERVAL = int(os.environ.get('WORKER_PURGE_OLD_ARTICLES_INTERVAL', 1440))  # Default: 24 hours
 ENRICH_ARTICLES_INTERVAL = int(os.environ.get('WORKER_ENRICH_ARTICLES_INTERVAL', 60))  # Default: 1 hour
-
-CATEGORY_KEYWORDS = {
-    'Politics': ['election', 'government', 'senate', 'congress', 'president', 'politics', 'law', 'policy', 'minister', 'parliament'],
-    'US': ['united states', 'america', 'us ', 'usa', 'american', 'washington', 'new york', 'california'],
-    'World': ['world', 'global', 'international', 'foreign', 'abroad', 'overseas'],
-    'Sports': ['sport', 'game', 'match', 'tournament', 'league', 'nba', 'nfl', 'mlb', 'soccer', 'football', 'basketball', 'olympics'],
-    'Technology': ['tech', 'technology', 'software', 'hardware', 'computer', 'ai', 'artificial intelligence', 'internet', 'app', 'gadget', 'device'],
-    'Entertainment': ['movie', 'film', 'music', 'entertainment', 'tv', 'show', 'celebrity', 'concert', 'festival'],
-    'Science': ['science', 'research', 'study', 'scientist', 'space', 'nasa', 'physics', 'chemistry', 'biology'],
-    'Health': ['health', 'medicine', 'medical', 'doctor', 'hospital', 'disease', 'virus', 'covid', 'wellness'],
-    'Business': ['business', 'market', 'stock', 'finance', 'economy', 'trade', 'company', 'corporate', 'industry'],
-}
+CLASSIFIER_TRAIN_INTERVAL = int(os.environ.get('WORKER_CLASSIFIER_TRAIN_INTERVAL', 1440))  # Default: 24 hours
 
 # Get timezone from environment variable, default to UTC
 TIMEZONE = pytz.timezone(os.environ.get('TIMEZONE', 'UTC'))
 
-# Add at the top, after imports
-THUMBNAIL_DIR = os.environ.get('THUMBNAIL_DIR', '/thumbnails')
-
-def debug_log(msg):
-    if os.environ.get('BACKEND_DEBUG', '').lower() == 'true':
-        print(f'[DEBUG] {msg}')
-
 def get_freshrss_client() -> FreshRSSAPIExt:
     """Create and return a FreshRSS API client instance using environment variables."""
     try:
@@ -90,34 +106,49 @@ def get_freshrss_client() -> FreshRSSAPIExt:
     except Exception as e:
         raise ValueError("Failed to initialize FreshRSS client")
 
-def get_or_create_category(db: Session, name: str) -> Category:
-    category = db.query(Category).filter(Category.name == name).first()
-    if category:
-        return category
-    category = Category(name=name)
-    db.add(category)
-    try:
-        db.commit()
-        db.refresh(category)
-    except IntegrityError:
-        db.rollback()
-        category = db.query(Category).filter(Category.name == name).first()
-    return category
-
-def get_greader_auth_token(api_url, username, password):
-    login_url = f"{api_url}/accounts/ClientLogin"
-    params = {"Email": username, "Passwd": password}
-    resp = requests.get(login_url, params=params)
-    if resp.status_code != 200:
-        debug_log(f'GReader API login error: {resp.status_code} {resp.text}')
-        raise Exception("Failed to get GReader Auth token")
-    for line in resp.text.splitlines():
-        if line.startswith("Auth="):
-            token = line.split("=", 1)[1]
-            debug_log(f'GReader Auth token fetched: {token[:8]}...')
-            return token
-    debug_log(f'GReader API login response did not contain Auth token: {resp.text}')
-    raise Exception("Auth token not found in response")
+# Category name -> id for this worker process; the category set is tiny and rarely changes
+_category_ids: Dict[str, int] = {}
+
+def warm_category_cache(db: Session):
+    """Load every category id and create any of CATEGORIES that is missing."""
+    _category_ids.clear()
+    _category_ids.update({row.name: row.id for row in db.execute(select(Category.id, Category.name))})
+    get_category_ids(db, CATEGORIES)
+    db.commit()
+
+def get_category_ids(db: Session, names: List[str]) -> Dict[str, int]:
+    """Ids for the given category names, creating missing categories; only cache misses touch the database."""
+    missing = [name for name in set(names) if name not in _category_ids]
+    if missing:
+        # ON CONFLICT DO NOTHING so concurrent workers creating the same name do not fail
+        db.execute(pg_insert(Category).values([{'name': name} for name in missing]).on_conflict_do_nothing(index_elements=['name']))
+        for row in db.execute(select(Category.id, Category.name).where(Category.name.in_(missing))):
+            _category_ids[row.name] = row.id
+    return {name: _category_ids[name] for name in names if name in _category_ids}
+
+def link_categories(db: Session, results: Dict[int, Dict[str, Any]]) -> int:
+    """Insert article_category rows for categorize_texts results in one statement, recording their source; the caller commits."""
+    names = {name for result in results.values() for name in result['categories']}
+    for attempt in range(2):
+        category_ids = get_category_ids(db, list(names))
+        rows = [
+            {'article_id': article_id, 'category_id': category_ids[name], 'source': result['source']}
+            for article_id, result in results.items()
+            for name in dict.fromkeys(result['categories']) if name in category_ids
+        ]
+        if not rows:
+            return 0
+        try:
+            with db.begin_nested():
+                db.execute(insert(article_category), rows)
+            return len(rows)
+        except IntegrityError:
+            # A cached id points at a category deleted since the cache was filled
+            if attempt:
+                raise
+            debug_log('Category id cache is stale, reloading')
+            _category_ids.clear()
+    return 0
 
 def extract_url(item):
     if 'alternate' in item and item['alternate']:
@@ -141,211 +172,214 @@ def convert_timestamp_to_timezone(timestamp):
     """Convert a Unix timestamp to datetime in configured timezone."""
     return datetime.fromtimestamp(timestamp, TIMEZONE)
 
-def fetch_articles_from_greader_api(batch_size=None, days=None):
+def parse_greader_item(item) -> Dict[str, Any]:
+    """Convert a raw GReader item into the article dict used by process_articles."""
+    url = extract_url(item)
+    if not url:
+        debug_log(f'Skipping article with no URL. id={item.get("id")}')
+        return None
+    # The summary HTML is kept once; it becomes the description and enrichment fills content later
+    return {
+        'title': item.get('title'),
+        'link': url,
+        'summary': item.get('summary', {}).get('content', ''),
+        'thumbnail_url': extract_thumbnail(item),
+        'source_name': item.get('origin', {}).get('title', ''),
+        'source_url': item.get('origin', {}).get('htmlUrl', ''),
+        'published_at': convert_timestamp_to_timezone(item.get('published', 0))
+    }
+
+def article_fingerprint(article: Dict[str, Any]) -> str:
+    """Hash of the fields FreshRSS can change: title, summary and enclosure image."""
+    parts = (article.get('title') or '', article.get('summary') or '', article.get('thumbnail_url') or '')
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+def parse_greader_page(items, seen_links: set) -> List[Dict[str, Any]]:
+    """Parse one page of raw items, dropping links already seen earlier in the run."""
+    articles = []
+    for item in items:
+        article = parse_greader_item(item)
+        if article and article['link'] not in seen_links:
+            seen_links.add(article['link'])
+            articles.append(article)
+    return articles
+
+def get_stream_watermark(stream: str) -> Dict[str, Any]:
+    """Return the stored high-water mark for a GReader stream, or None if there is none."""
+    try:
+        data = redis_client.get(f'greader:watermark:{stream}')
+        return json.loads(data) if data else None
+    except Exception as e:
+        debug_log(f'Failed to read watermark for {stream}: {e}')
+        return None
+
+def set_stream_watermark(stream: str, watermark: Dict[str, Any]):
+    try:
+        redis_client.set(f'greader:watermark:{stream}', json.dumps(watermark))
+    except Exception as e:
+        debug_log(f'Failed to store watermark for {stream}: {e}')
+
+def get_item_crawl_time(item) -> int:
+    """Crawl time of a GReader item in seconds, falling back to its published time."""
+    if item.get('crawlTimeMsec'):
+        return int(item['crawlTimeMsec']) // 1000
+    return int(item.get('published', 0))
+
+async def fetch_stream_pages(client: GReaderClient, stream: str, batch_size: int, days: int,
+                             seen_links: set, watermarks: Dict[str, Dict[str, Any]]):
+    """
+    Yield parsed article pages of one GReader stream.
+
+    Only items crawled after the stream's watermark are requested, except
+    every FULL_SYNC_INTERVAL minutes when the whole FETCH_DAYS window is
+    re-read. The new watermark is put in `watermarks` once the stream has
+    been read completely; a failed stream leaves its watermark untouched.
+    """
+    now = int(time.time())
+    window_start = now - days * 86400
+    watermark = get_stream_watermark(stream)
+    full_sync = not watermark or now - watermark.get('full_sync_at', 0) >= FULL_SYNC_INTERVAL * 60
+    if full_sync:
+        since = window_start
+        watermark = {'crawl_ts': 0, 'newest_id': None, 'full_sync_at': now}
+        debug_log(f'Full window sync of {stream} since {since}')
+    else:
+        # FreshRSS applies `ot` to the entry id, which is its crawl time
+        since = max(window_start, watermark['crawl_ts'] - WATERMARK_OVERLAP)
+        debug_log(f'Incremental sync of {stream} since {since}')
+
+    try:
+        async for items in client.iter_stream(stream, since=since, batch_size=batch_size):
+            for item in items:
+                crawl_ts = get_item_crawl_time(item)
+                if crawl_ts > watermark['crawl_ts']:
+                    watermark['crawl_ts'] = crawl_ts
+                    watermark['newest_id'] = item.get('id')
+            articles = parse_greader_page(items, seen_links)
+            del items
+            yield articles
+    except GReaderError as e:
+        debug_log(f'Stopped fetching {stream}, watermark not advanced: {e}')
+        return
+    watermarks[stream] = watermark
+
+async def fetch_feed_streams(client: GReaderClient, streams: List[str], batch_size: int, days: int,
+                             seen_links: set, watermarks: Dict[str, Dict[str, Any]]):
+    """
+    Read every feed stream concurrently, at most CONCURRENT_FETCH_TASKS at a
+    time, and yield their pages in arrival order so one slow or large feed
+    does not hold up the others.
+    """
+    queue = asyncio.Queue(maxsize=CONCURRENT_FETCH_TASKS)
+
+    async def read_stream(stream):
+        async with fetch_semaphore:
+            async for articles in fetch_stream_pages(client, stream, batch_size, days, seen_links, watermarks):
+                await queue.put(articles)
+
+    async def read_all():
+        try:
+            results = await asyncio.gather(*(read_stream(stream) for stream in streams), return_exceptions=True)
+            for stream, result in zip(streams, results):
+                if isinstance(result, Exception):
+                    debug_log(f'Failed to fetch {stream}: {result}')
+        finally:
+            await queue.put(None)
+
+    producer = asyncio.ensure_future(read_all())
+    try:
+        while True:
+            articles = await queue.get()
+            if articles is None:
+                break
+            yield articles
+    finally:
+        producer.cancel()
+
+async def fetch_articles_from_greader_api(batch_size=None, days=None):
     """
     Fetch articles from the FreshRSS GReader API endpoint using GoogleLogin auth.
-    Supports pagination to fetch all articles within the specified time period.
+    Async generator yielding one list of articles per continuation page; the
+    next page is already in flight while the caller processes the current one.
+
+    Raw items are parsed and released page by page, so memory is bounded by
+    the page size rather than the fetch window. With FETCH_MODE 'feeds' every
+    subscription is read as its own stream instead of the single reading-list.
+    Stream watermarks are only stored once every page has been consumed.
     """
-    api_url = os.environ.get('FRESHRSS_GREADER_API_URL')
-    api_user = os.environ.get('FRESHRSS_GREADER_API_USER')
-    api_password = os.environ.get('FRESHRSS_GREADER_API_PASSWORD')
-    if not api_url or not api_user or not api_password:
+    client = GReaderClient.from_env()
+    if client is None:
         debug_log('GReader API credentials or URL not set')
-        return []
-    try:
-        auth_token = get_greader_auth_token(api_url, api_user, api_password)
-    except Exception as e:
-        debug_log(f'Failed to get GReader Auth token: {e}')
-        return []
+        return
 
-    # Calculate time window
-    now = int(time.time())
-    since = now - (days or FETCH_DAYS) * 86400
-    
-    all_articles = []
-    continuation_token = None
-    batch_count = 0
-    
-    while True:
-        batch_count += 1
-        debug_log(f'Fetching batch {batch_count} of articles')
-        
-        params = {
-            'output': 'json',
-            'n': batch_size or FETCH_LIMIT,
-            'ot': since
-        }
-        
-        # Add continuation token if we have one
-        if continuation_token:
-            params['c'] = continuation_token
-            
-        url = f'{api_url}/reader/api/0/stream/contents/reading-list'
-        headers = {'Authorization': f'GoogleLogin auth={auth_token}'}
-        
-        debug_log(f'Fetching from GReader API: {url} with params {params}')
-        resp = requests.get(url, params=params, headers=headers)
-        
-        if resp.status_code != 200:
-            debug_log(f'GReader API error: {resp.status_code} {resp.text}')
-            break
-            
+    batch_size = batch_size or FETCH_LIMIT
+    days = days or FETCH_DAYS
+    total = 0
+    seen_links = set()
+    watermarks = {}
+    async with client:
         try:
-            data = resp.json()
-        except Exception as e:
-            debug_log(f'GReader API response (truncated): {resp.text[:200]}')
-            debug_log(f'GReader API JSON decode error: {e}')
-            break
-            
-        items = data.get('items', [])
-        debug_log(f'Fetched {len(items)} items from GReader API in batch {batch_count}')
-        
-        if not items:
-            debug_log('No more items to fetch')
-            break
-            
-        for item in items:
-            url = extract_url(item)
-            if not url:
-                debug_log(f'Skipping article with no URL. id={item.get("id")}')
-                continue
-                
-            article = {
-                'id': item.get('id'),
-                'title': item.get('title'),
-                'link': url,
-                'description': item.get('summary', {}).get('content', ''),
-                'content': item.get('summary', {}).get('content', ''),
-                'summary': item.get('summary', {}).get('content', ''),
-                'thumbnail_url': extract_thumbnail(item),
-                'source_name': item.get('origin', {}).get('title', ''),
-                'source_url': item.get('origin', {}).get('htmlUrl', ''),
-                'published_at': convert_timestamp_to_timezone(item.get('published', 0)),
-                'processed_at': get_current_time(),
-                'is_processed': False
-            }
-            all_articles.append(article)
-            
-        # Get continuation token for next batch
-        continuation_token = data.get('continuation')
-        if not continuation_token:
-            debug_log('No continuation token, finished fetching all articles')
-            break
-            
-        # Add a small delay between batches to be polite
-        time.sleep(1)
-        
-    debug_log(f'Finished fetching all articles. Total articles fetched: {len(all_articles)}')
-    return all_articles
-
-# Replace fetch_articles to use GReader API
-async def fetch_articles(batch_size=None) -> list:
-    return fetch_articles_from_greader_api(batch_size=batch_size, days=FETCH_DAYS)
-
-def keyword_based_categorization(text: str) -> List[str]:
-    """Fallback categorization using keyword matching."""
-    lower_text = text.lower()
-    categories = []
-    for category, keywords in CATEGORY_KEYWORDS.items():
-        if any(keyword in lower_text for keyword in keywords):
-            categories.append(category)
-    return categories
-
-async def categorize_article(text: str) -> List[str]:
-    # Try Ollama first
-    prompt = (
-        f"Given the following news article, assign up to 3 categories from this list that are clearly and unambiguously relevant: "
-        f"[{', '.join(CATEGORIES)}]. Return only a JSON array of category names. "
-        f"Do not include any category unless it is obviously relevant. If none are clearly relevant, return an empty array.\n\n"
-        f"Article:\n{text}\n\nCategories:"
-    )
+            await client.get_auth_token()
+            if FETCH_MODE == 'feeds':
+                streams = await client.list_subscriptions()
+                debug_log(f'Fetching {len(streams)} feeds, {CONCURRENT_FETCH_TASKS} at a time')
+                pages = fetch_feed_streams(client, streams, batch_size, days, seen_links, watermarks)
+            else:
+                pages = fetch_stream_pages(client, 'reading-list', batch_size, days, seen_links, watermarks)
+        except (GReaderError, httpx.HTTPError) as e:
+            debug_log(f'Failed to start GReader fetch: {e}')
+            return
+
+        async for articles in pages:
+            total += len(articles)
+            yield articles
+
+    for stream, watermark in watermarks.items():
+        set_stream_watermark(stream, watermark)
+    debug_log(f'Finished fetching all articles. Total articles fetched: {total}')
+
+@celery_app.task
+def backfill_related_indexes():
+    db = SessionLocal()
     try:
-        async with httpx.AsyncClient() as client:
-            res = await client.post(
-                f"{os.getenv('OLLAMA_URL')}/api/generate",
-                json={
-                    "model": os.getenv('OLLAMA_MODEL', 'llama2'),
-                    "prompt": prompt,
-                    "stream": False
-                }
-            )
-            if res.status_code != 200:
-                return keyword_based_categorization(text)
-            
-            data = res.json()
-            
-            if 'response' not in data:
-                return keyword_based_categorization(text)
-            
-            match = re.search(r"\[.*\]", data['response'])
-            if not match:
-                return keyword_based_categorization(text)
-            
-            try:
-                categories = json.loads(match.group(0))
-                # Filter out any categories that aren't in our predefined list and limit to 3
-                valid_categories = [cat for cat in categories if cat in CATEGORIES][:3]
-                return valid_categories
-            except json.JSONDecodeError as e:
-                return keyword_based_categorization(text)
+        backfill_indexes(db)
     except Exception as e:
-        return keyword_based_categorization(text)
-
-def find_related_articles(db: Session, article: Article, all_articles: List[Article]) -> List[Article]:
-    SIMILARITY_THRESHOLD = 0.3
-    MAX_RELATED = 3
-    def jaccard_similarity(a: str, b: str) -> float:
-        set_a = set(a.lower().split())
-        set_b = set(b.lower().split())
-        intersection = len(set_a.intersection(set_b))
-        union = len(set_a.union(set_b))
-        return intersection / union if union > 0 else 0
-    related = []
-    for other in all_articles:
-        if other.id != article.id:
-            similarity = jaccard_similarity(article.title, other.title)
-            if similarity >= SIMILARITY_THRESHOLD:
-                related.append(other)
-                if len(related) >= MAX_RELATED:
-                    break
-    return related
-
-def save_thumbnail(image_url, article_id):
-    debug_log(f'Running save_thumbnail for article_id={article_id}, image_url={image_url}')
+        debug_log(f'Failed to backfill related-article indexes: {e}')
+        db.rollback()
+    finally:
+        db.close()
+
+@celery_app.task
+def reindex_near_duplicates():
+    db = SessionLocal()
     try:
-        response = httpx.get(image_url, timeout=10)
-        if response.status_code == 200:
-            img = Image.open(BytesIO(response.content))
-            img = img.convert('RGB')  # Ensure compatibility with webp
-            img.thumbnail(THUMB_SIZE)
-            os.makedirs(THUMBNAIL_DIR, exist_ok=True)
-            thumbnail_path = os.path.join(THUMBNAIL_DIR, f'{article_id}.webp')
-            img.save(thumbnail_path, 'WEBP')
-            debug_log(f'save_thumbnail succeeded for article_id={article_id}, saved to {thumbnail_path}')
-            return f'/thumbnails/{article_id}.webp'
-        else:
-            debug_log(f'save_thumbnail failed for article_id={article_id}, HTTP status {response.status_code}')
+        reindex_simhashes(db)
     except Exception as e:
-        debug_log(f'Failed to create thumbnail for {article_id}: {e}')
-    return None
+        debug_log(f'Failed to reindex SimHashes: {e}')
+        db.rollback()
+    finally:
+        db.close()
 
-def is_probably_icon(url):
-    """Return True if the image URL looks like an icon/logo/social icon."""
-    icon_keywords = ['icon', 'favicon', 'logo', 'twitter', 'facebook', 'linkedin', 'sprite', 'apple-touch']
-    url_lower = url.lower()
-    return any(keyword in url_lower for keyword in icon_keywords)
+@worker_ready.connect
+def on_worker_ready(**kwargs):
+    invalidate_stale_category_cache()
+    # Queued rather than run here: this is the parent process, and database work
+    # here would leave pooled connections for every forked pool process to share
+    backfill_related_indexes.delay()
+    reindex_near_duplicates.delay()
 
-def is_small_image(url, min_width=100, min_height=100):
-    """Return True if the image is smaller than the minimum dimensions."""
+@worker_process_init.connect
+def on_worker_process_init(**kwargs):
+    # Connections inherited from the parent must not be reused by the child
+    engine.dispose(close=False)
+    db = SessionLocal()
     try:
-        with httpx.stream('GET', url, timeout=5.0) as response:
-            if response.status_code == 200:
-                img = Image.open(BytesIO(response.read()))
-                width, height = img.size
-                return width < min_width or height < min_height
-    except Exception:
-        pass
-    return False
+        warm_category_cache(db)
+    except Exception as e:
+        debug_log(f'Failed to warm category cache: {e}')
+        db.rollback()
+    finally:
+        db.close()
 
 @celery_app.on_after_configure.connect
 def setup_periodic_tasks(sender, **kwargs):
@@ -408,6 +442,35 @@ def setup_periodic_tasks(sender, **kwargs):
             name=f'enrich_articles_every_{ENRICH_ARTICLES_INTERVAL}_minutes'
     )
     
+    # Dispatch articles whose pipeline chord never finished, without waiting for FreshRSS to return them
+    sender.add_periodic_task(
+        timedelta(minutes=PIPELINE_RETRY_AFTER),
+        redispatch_unprocessed_articles.s(),
+        name=f'redispatch_unprocessed_articles_every_{PIPELINE_RETRY_AFTER}_minutes'
+    )
+
+    # Retrain the local category classifier from the categories stored since the last run
+    if CLASSIFIER_TRAIN_INTERVAL % 1440 == 0:
+        days = CLASSIFIER_TRAIN_INTERVAL // 1440
+        sender.add_periodic_task(
+            crontab(hour=1, minute=0, day_of_month=f'*/{days}'),
+            train_category_classifier.s(),
+            name=f'train_category_classifier_every_{days}_days'
+        )
+    elif CLASSIFIER_TRAIN_INTERVAL % 60 == 0:
+        hours = CLASSIFIER_TRAIN_INTERVAL // 60
+        sender.add_periodic_task(
+            crontab(minute=30, hour=f'*/{hours}'),
+            train_category_classifier.s(),
+            name=f'train_category_classifier_every_{hours}_hours'
+        )
+    else:
+        sender.add_periodic_task(
+            crontab(minute=f'*/{CLASSIFIER_TRAIN_INTERVAL}'),
+            train_category_classifier.s(),
+            name=f'train_category_classifier_every_{CLASSIFIER_TRAIN_INTERVAL}_minutes'
+        )
+
     # Also trigger the initial tasks
     process_articles.delay()
     enrich_articles.delay()
@@ -425,102 +488,7 @@ def process_articles(self):
     db = SessionLocal()
     try:
         loop = asyncio.get_event_loop()
-        fresh_articles = loop.run_until_complete(fetch_articles())
-        debug_log(f'Fetched {len(fresh_articles)} fresh articles')
-        
-        # Get all existing article URLs in a single query
-        existing_articles = {
-            article.link: article 
-            for article in db.query(Article).filter(
-                Article.link.in_([a['link'] for a in fresh_articles])
-            ).all()
-        }
-        
-        # Filter out already processed articles
-        new_articles = [
-            article for article in fresh_articles 
-            if article['link'] not in existing_articles or 
-               not existing_articles[article['link']].is_processed
-        ]
-        
-        debug_log(f'Found {len(new_articles)} new articles to process')
-        
-        BATCH_SIZE = 10
-        for i in range(0, len(new_articles), BATCH_SIZE):
-            batch = new_articles[i:i + BATCH_SIZE]
-            debug_log(f'Processing batch {i//BATCH_SIZE+1}: {len(batch)} articles')
-            
-            for fresh_article in batch:
-                try:
-                    article_link = fresh_article.get('link', '')
-                    if not article_link:
-                        debug_log('Skipping article with no URL')
-                        continue
-                        
-                    existing_article = existing_articles.get(article_link)
-                    
-                    article_data = {
-                        'title': fresh_article.get('title', ''),
-                        'link': article_link,
-                        'description': fresh_article.get('description', ''),
-                        'content': fresh_article.get('content', ''),
-                        'source_name': fresh_article.get('source_name', ''),
-                        'source_url': fresh_article.get('source_url', ''),
-                        'published_at': fresh_article.get('published_at'),
-                        'processed_at': get_current_time(),
-                        'is_processed': False,
-                        'image_url': fresh_article.get('thumbnail_url', '')
-                    }
-                    
-                    if existing_article:
-                        debug_log(f'Updating existing article: {article_link}')
-                        for key, value in article_data.items():
-                            setattr(existing_article, key, value)
-                        article = existing_article
-                    else:
-                        debug_log(f'Creating new article: {article_link}')
-                        article = Article(**article_data)
-                        db.add(article)
-                        db.commit()
-                        db.refresh(article)
-                        
-                    if not article.categories:
-                        text = f"{article.title} {article.description}"
-                        debug_log(f'Categorizing article: {article_link}')
-                        categories = loop.run_until_complete(categorize_article(text))
-                        debug_log(f'Categories for {article_link}: {categories}')
-                        for category_name in categories:
-                            category = get_or_create_category(db, category_name)
-                            article.categories.append(category)
-                            
-                    if not article.related_articles:
-                        debug_log(f'Finding related articles for: {article_link}')
-                        all_articles = db.query(Article).all()
-                        related = find_related_articles(db, article, all_articles)
-                        debug_log(f'Found {len(related)} related articles')
-                        article.related_articles.extend(related)
-                        
-                    if not article.thumbnail_url:
-                        enclosures = fresh_article.get('enclosures', [])
-                        image_url = enclosures[0]['url'] if enclosures and 'url' in enclosures[0] else ''
-                        if image_url:
-                            debug_log(f'Generating thumbnail for: {article_link}')
-                            thumbnail_url = save_thumbnail(image_url, article.id)
-                            if thumbnail_url:
-                                article.thumbnail_url = thumbnail_url
-                                article.image_url = image_url
-                                debug_log(f'Thumbnail set for: {article_link}')
-                                
-                    article.is_processed = True
-                    db.commit()
-                    
-                except Exception as e:
-                    debug_log(f'Exception processing article: {e}')
-                    db.rollback()
-                    continue
-                    
-            time.sleep(1)
-            
+        loop.run_until_complete(ingest_articles(db))
     except Exception as e:
         debug_log(f'Exception in process_articles: {e}')
         db.rollback()
@@ -529,6 +497,249 @@ def process_articles(self):
         db.close()
         debug_log('process_articles task finished')
 
+async def ingest_articles(db: Session):
+    """
+    Stream pages from FreshRSS and upsert each one in a worker thread, so the
+    event loop keeps downloading the next page while this one is written.
+    Each page's new ids are handed to the article pipeline straight away.
+    """
+    loop = asyncio.get_running_loop()
+    page_count = 0
+    async for fresh_articles in fetch_articles_from_greader_api():
+        page_count += 1
+        debug_log(f'Upserting page {page_count}: {len(fresh_articles)} fetched articles')
+        article_ids = await loop.run_in_executor(None, store_article_page, db, fresh_articles)
+        debug_log(f'Upserted page {page_count}, {len(article_ids)} articles to process')
+        dispatch_article_pipeline(article_ids)
+
+def store_article_page(db: Session, fresh_articles: List[Dict[str, Any]]) -> List[int]:
+    """Upsert one page, index it for related lookups and link its near-duplicates; returns the ids that still need processing."""
+    article_ids = upsert_article_page(db, fresh_articles)
+    index_articles(db, article_ids)
+    db.commit()
+    link_near_duplicates(db, article_ids)
+    return article_ids
+
+def share_with_near_duplicates(db: Session, article_ids: List[int]):
+    """
+    Copy categories and thumbnails between near-duplicates and their canonical
+    article, in whichever direction is missing. Works for ids on either side,
+    so it does not matter whether the canonical or the duplicate finishes first.
+    """
+    duplicates = db.query(Article).filter(
+        Article.canonical_id != None,
+        (Article.id.in_(article_ids)) | (Article.canonical_id.in_(article_ids))
+    ).all()
+    if not duplicates:
+        return
+    canonicals = {
+        article.id: article
+        for article in db.query(Article).filter(Article.id.in_({d.canonical_id for d in duplicates})).all()
+    }
+    for duplicate in duplicates:
+        canonical = canonicals.get(duplicate.canonical_id)
+        if canonical is None:
+            continue
+        if not duplicate.categories and canonical.categories:
+            duplicate.categories = list(canonical.categories)
+        if not duplicate.thumbnail_url and canonical.thumbnail_url:
+            # Copy the file so the duplicate keeps its thumbnail if the canonical is purged first
+            source = os.path.join(THUMBNAIL_DIR, f'{canonical.id}.webp')
+            try:
+                shutil.copyfile(source, os.path.join(THUMBNAIL_DIR, f'{duplicate.id}.webp'))
+                duplicate.thumbnail_url = f'/thumbnails/{duplicate.id}.webp'
+                duplicate.image_url = canonical.image_url
+            except OSError as e:
+                debug_log(f'Failed to copy thumbnail {source} for article {duplicate.id}: {e}')
+
+def dispatch_article_pipeline(article_ids: List[int]):
+    """
+    Fan the ids out in chunks. Each chunk is categorized, related and
+    thumbnailed by parallel subtasks, then marked processed once all three finish.
+    """
+    for i in range(0, len(article_ids), PIPELINE_CHUNK_SIZE):
+        chunk = article_ids[i:i + PIPELINE_CHUNK_SIZE]
+        chord(group(
+            categorize_articles.si(chunk),
+            relate_articles.si(chunk),
+            thumbnail_articles.si(chunk)
+        ))(finalize_articles.si(chunk))
+
+# Columns overwritten when FreshRSS returns an article we already have but have not finished processing
+UPSERT_COLUMNS = [
+    'title', 'description', 'source_name', 'source_url',
+    'published_at', 'processed_at', 'is_processed', 'image_url', 'content_hash'
+]
+
+def upsert_article_page(db: Session, fresh_articles: List[Dict[str, Any]]) -> List[int]:
+    """
+    Write one page of fetched articles with a single INSERT ... ON CONFLICT (link)
+    DO UPDATE ... RETURNING id. Articles that are already processed are left
+    untouched and not returned, so the result is the ids that still need work.
+    Unprocessed articles whose fingerprint is unchanged are skipped too, unless
+    they were last dispatched more than PIPELINE_RETRY_AFTER minutes ago.
+    """
+    now = get_current_time()
+    rows = {}
+    for fresh_article in fresh_articles:
+        # ON CONFLICT cannot touch the same row twice in one statement
+        rows[fresh_article['link']] = {
+            'title': fresh_article.get('title') or '',
+            'link': fresh_article['link'],
+            'description': fresh_article.get('summary', ''),
+            'source_name': fresh_article.get('source_name', ''),
+            'source_url': fresh_article.get('source_url', ''),
+            'published_at': fresh_article.get('published_at'),
+            'processed_at': now,
+            'is_processed': False,
+            'image_url': fresh_article.get('thumbnail_url', ''),
+            'content_hash': article_fingerprint(fresh_article)
+        }
+    if not rows:
+        return []
+
+    stmt = pg_insert(Article).values(list(rows.values()))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Article.link],
+        set_={column: stmt.excluded[column] for column in UPSERT_COLUMNS},
+        where=(Article.is_processed == False) & (
+            Article.content_hash.is_distinct_from(stmt.excluded.content_hash) |
+            (Article.processed_at < now - timedelta(minutes=PIPELINE_RETRY_AFTER))
+        )
+    ).returning(Article.id)
+    article_ids = [row.id for row in db.execute(stmt)]
+    db.commit()
+    return article_ids
+
+@celery_app.task(bind=True, max_retries=3, default_retry_delay=60)
+def categorize_articles(self, article_ids: List[int]):
+    """Categorize the articles in a chunk that have no categories yet, in batched Ollama calls."""
+    db = SessionLocal()
+    try:
+        loop = asyncio.get_event_loop()
+        articles = db.query(Article).filter(Article.id.in_(article_ids)).all()
+        # Near-duplicates inherit categories from their canonical article in finalize_articles
+        pending = [article for article in articles if not article.categories and article.canonical_id is None]
+        if pending:
+            texts = {article.id: f"{article.title} {article.description}" for article in pending}
+            results = loop.run_until_complete(categorize_texts(texts))
+            for article in pending:
+                result = results[article.id]
+                debug_log(f'Categories for {article.link} from {result["source"]}: {result["categories"]}')
+            link_categories(db, results)
+        db.commit()
+    except Exception as e:
+        debug_log(f'Exception in categorize_articles: {e}')
+        db.rollback()
+        self.retry(exc=e)
+    finally:
+        db.close()
+
+def unlinked_articles(db: Session, article_ids: List[int]) -> List[int]:
+    linked = set(db.execute(
+        select(article_related.c.article_id).where(article_related.c.article_id.in_(article_ids))
+    ).scalars())
+    return [article_id for article_id in article_ids if article_id not in linked]
+
+@celery_app.task(bind=True, max_retries=3, default_retry_delay=60)
+def relate_articles(self, article_ids: List[int]):
+    """
+    Link related articles for the articles in a chunk that have none yet, and
+    add the links to the story clusters. Links and stories are committed in
+    one transaction under the story lock, so a failed run leaves the articles
+    unlinked and the retry finds and clusters them again.
+    """
+    db = SessionLocal()
+    try:
+        pending = unlinked_articles(db, article_ids)
+        if pending:
+            related = find_related_articles(db, pending)
+            debug_log(f'Found {sum(map(len, related.values()))} related articles for {len(pending)} articles')
+            with story_lock():
+                # A duplicate delivery may have linked some of them meanwhile
+                pending = set(unlinked_articles(db, pending))
+                related = {article_id: ids for article_id, ids in related.items() if article_id in pending}
+                link_related(db, related)
+                assign_stories(db, related_edges(related))
+                db.commit()
+        db.commit()
+    except Exception as e:
+        debug_log(f'Exception in relate_articles: {e}')
+        db.rollback()
+        self.retry(exc=e)
+    finally:
+        db.close()
+
+@celery_app.task(bind=True, max_retries=3, default_retry_delay=60)
+def thumbnail_articles(self, article_ids: List[int]):
+    """Generate thumbnails from the enclosure image of the articles in a chunk that have none yet."""
+    db = SessionLocal()
+    try:
+        articles = db.query(Article).filter(
+            Article.id.in_(article_ids),
+            Article.thumbnail_url == None,
+            Article.canonical_id == None
+        ).all()
+        for article in articles:
+            if not article.image_url:
+                continue
+            thumbnail_url = save_thumbnail(article.image_url, article.id)
+            if thumbnail_url:
+                article.thumbnail_url = thumbnail_url
+                debug_log(f'Thumbnail set for: {article.link}')
+        db.commit()
+    except Exception as e:
+        debug_log(f'Exception in thumbnail_articles: {e}')
+        db.rollback()
+        self.retry(exc=e)
+    finally:
+        db.close()
+
+@celery_app.task
+def redispatch_unprocessed_articles() -> int:
+    """
+    Dispatch the pipeline again for articles still unprocessed PIPELINE_RETRY_AFTER
+    minutes after their last dispatch, such as chunks whose chord lost a subtask.
+    processed_at is moved forward in the same statement, so an overlapping run or
+    upsert does not dispatch them twice.
+    """
+    db = SessionLocal()
+    try:
+        now = get_current_time()
+        stuck = (
+            select(Article.id)
+            .where(Article.is_processed == False, Article.processed_at < now - timedelta(minutes=PIPELINE_RETRY_AFTER))
+            .order_by(Article.processed_at)
+            .limit(PIPELINE_SWEEP_LIMIT)
+        )
+        article_ids = sorted(db.execute(
+            update(Article).where(Article.id.in_(stuck.scalar_subquery())).values(processed_at=now).returning(Article.id)
+        ).scalars())
+        db.commit()
+    finally:
+        db.close()
+    if article_ids:
+        debug_log(f'Dispatching {len(article_ids)} unprocessed articles again')
+        dispatch_article_pipeline(article_ids)
+    return len(article_ids)
+
+@celery_app.task(bind=True, max_retries=3, default_retry_delay=60)
+def finalize_articles(self, article_ids: List[int]):
+    """Mark a chunk processed once its categorize/relate/thumbnail subtasks have finished."""
+    db = SessionLocal()
+    try:
+        share_with_near_duplicates(db, article_ids)
+        db.query(Article).filter(Article.id.in_(article_ids)).update(
+            {Article.is_processed: True}, synchronize_session=False
+        )
+        db.commit()
+    except Exception as e:
+        debug_log(f'Exception in finalize_articles: {e}')
+        db.rollback()
+        self.retry(exc=e)
+    finally:
+        db.close()
+
 @celery_app.task(
     bind=True,
     max_retries=3,
@@ -556,7 +767,9 @@ def purge_old_articles(self):
                     debug_log(f'Removed thumbnail: {thumbnail_path}')
             except Exception as e:
                 debug_log(f'Error removing thumbnail {thumbnail_path}: {e}')
+        delete_empty_stories(db)
         db.commit()
+        prune_index(db)
     except Exception as e:
         debug_log(f'Exception in purge_old_articles: {e}')
         self.retry(exc=e)
@@ -564,6 +777,294 @@ def purge_old_articles(self):
         db.close()
         debug_log('purge_old_articles task finished')
 
+@celery_app.task
+def train_category_classifier():
+    """Retrain the local category classifier from article_category and publish it to every worker."""
+    db = SessionLocal()
+    try:
+        return train_from_db(db, CATEGORIES)
+    finally:
+        db.close()
+
+def get_rebuild_state(key: str) -> Dict[str, str]:
+    return {field.decode(): value.decode() for field, value in redis_client.hgetall(key).items()}
+
+def get_rebuild_status(key: str) -> Dict[str, Any]:
+    """Progress of the current or last rebuild stored under key, with its rate and ETA."""
+    state = get_rebuild_state(key)
+    if not state:
+        return {'status': 'idle'}
+    processed, total = int(state.get('processed', 0)), int(state.get('total', 0))
+    started_at, updated_at = float(state['started_at']), float(state.get('updated_at', state['started_at']))
+    elapsed = (time.time() if state['status'] == 'running' else updated_at) - started_at
+    rate = processed / elapsed if elapsed > 0 else 0.0
+    return {
+        'job_id': state['job_id'],
+        'status': state['status'],
+        'source_url': state.get('source_url') or None,
+        'last_id': int(state.get('last_id', 0)),
+        'processed': processed,
+        'skipped': int(state.get('skipped', 0)),
+        'total': total,
+        'rate_per_second': round(rate, 2),
+        'eta_seconds': round(max(total - processed, 0) / rate) if rate and state['status'] == 'running' else None,
+        'started_at': datetime.fromtimestamp(started_at, TIMEZONE).isoformat(),
+        'updated_at': datetime.fromtimestamp(updated_at, TIMEZONE).isoformat(),
+        'error': state.get('error'),
+    }
+
+def get_category_rebuild_status() -> Dict[str, Any]:
+    return get_rebuild_status(CATEGORY_REBUILD_KEY)
+
+def start_category_rebuild(source_url: Optional[str] = None) -> Dict[str, Any]:
+    """Recategorize every article, or only those of source_url; supersedes a rebuild already running."""
+    db = SessionLocal()
+    try:
+        query = db.query(func.count(Article.id))
+        if source_url:
+            query = query.filter(Article.source_url == source_url)
+        total = query.scalar()
+    finally:
+        db.close()
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    pipe = redis_client.pipeline()
+    pipe.delete(CATEGORY_REBUILD_KEY)
+    pipe.hset(CATEGORY_REBUILD_KEY, mapping={
+        'job_id': job_id, 'status': 'running', 'source_url': source_url or '',
+        'last_id': 0, 'enqueued': 0, 'processed': 0, 'skipped': 0, 'total': total, 'started_at': now, 'updated_at': now,
+    })
+    pipe.execute()
+    rebuild_categories.delay(job_id, 0)
+    return get_category_rebuild_status()
+
+# KEYS[1] rebuild hash; ARGV[1] job id; ARGV[2] expected checkpoint; ARGV[3] new checkpoint; ARGV[4] articles
+# advanced over; ARGV[5] of those skipped; ARGV[6] now. Returns 1 if this message moved the checkpoint.
+_ADVANCE_CHECKPOINT_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'job_id') ~= ARGV[1] or redis.call('HGET', KEYS[1], 'status') ~= 'running'
+        or redis.call('HGET', KEYS[1], 'last_id') ~= ARGV[2] then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'last_id', ARGV[3], 'attempts', 0, 'updated_at', ARGV[6])
+redis.call('HINCRBY', KEYS[1], 'processed', ARGV[4])
+redis.call('HINCRBY', KEYS[1], 'skipped', ARGV[5])
+return 1
+"""
+_advance_checkpoint = redis_client.register_script(_ADVANCE_CHECKPOINT_SCRIPT)
+
+def enqueue_category_rebuild(job_id: str, after_id: int, countdown: int = 0):
+    """Queue the chunk after after_id and record that it was queued, so a redelivered older message knows not to."""
+    rebuild_categories.apply_async((job_id, after_id), countdown=countdown)
+    redis_client.hset(CATEGORY_REBUILD_KEY, 'enqueued', after_id)
+
+@celery_app.task(bind=True, max_retries=3, default_retry_delay=60)
+def rebuild_categories(self, job_id: str, after_id: int):
+    """
+    Recategorize the next CATEGORY_REBUILD_CHUNK_SIZE articles after after_id,
+    checkpoint the last id in Redis and enqueue the next chunk. The checkpoint
+    only moves if it still equals after_id, so of two messages for the same
+    chunk only one continues the job. A message whose checkpoint has moved on
+    is a redelivery: if the worker died before queueing the next chunk, it
+    queues it; otherwise it is dropped.
+
+    Only confident answers (Ollama, cached or a confident classifier) replace
+    an article's categories, and the checkpoint only moves past articles that
+    got one: articles left over when OLLAMA_RUN_BUDGET runs out are retried
+    in the next chunk. An article Ollama leaves unanswered
+    CATEGORY_REBUILD_MAX_ATTEMPTS times in a row keeps its categories and is
+    counted as skipped. While the Ollama breaker is open the checkpoint is
+    held and the chunk is retried after BREAKER_COOLDOWN.
+    """
+    state = get_rebuild_state(CATEGORY_REBUILD_KEY)
+    if state.get('job_id') != job_id or state.get('status') != 'running':
+        debug_log(f'Dropping stale rebuild_categories message for job {job_id} after {after_id}')
+        return
+    if int(state.get('last_id', -1)) != after_id:
+        if state.get('enqueued') != state.get('last_id'):
+            debug_log(f'Category rebuild {job_id} lost its next chunk, queueing it after {state["last_id"]}')
+            enqueue_category_rebuild(job_id, int(state['last_id']))
+        else:
+            debug_log(f'Dropping stale rebuild_categories message for job {job_id} after {after_id}')
+        return
+    loop = asyncio.get_event_loop()
+    if not loop.run_until_complete(ollama_available()):
+        debug_log(f'Ollama unavailable, holding category rebuild {job_id} at {after_id}')
+        redis_client.hset(CATEGORY_REBUILD_KEY, 'updated_at', time.time())
+        enqueue_category_rebuild(job_id, after_id, countdown=BREAKER_COOLDOWN)
+        return
+    db = SessionLocal()
+    try:
+        query = select(Article.id, Article.title, Article.description).where(Article.id > after_id)
+        if state.get('source_url'):
+            query = query.where(Article.source_url == state['source_url'])
+        rows = db.execute(query.order_by(Article.id).limit(CATEGORY_REBUILD_CHUNK_SIZE)).all()
+        if not rows:
+            redis_client.hset(CATEGORY_REBUILD_KEY, mapping={'status': 'done', 'updated_at': time.time()})
+            debug_log(f'Category rebuild {job_id} finished')
+            return
+        texts = {row.id: f"{row.title} {row.description}" for row in rows}
+        results = loop.run_until_complete(categorize_texts(texts))
+        confident = {article_id: result for article_id, result in results.items() if result['confident']}
+        db.execute(delete(article_category).where(article_category.c.article_id.in_(list(confident))))
+        link_categories(db, confident)
+        db.commit()
+    except Exception as e:
+        debug_log(f'Exception in rebuild_categories: {e}')
+        db.rollback()
+        if self.request.retries >= self.max_retries:
+            redis_client.hset(CATEGORY_REBUILD_KEY, mapping={'status': 'failed', 'error': str(e), 'updated_at': time.time()})
+        self.retry(exc=e)
+    finally:
+        db.close()
+
+    if len(confident) < len(texts) and not ollama_breaker.is_closed():
+        # The breaker opened during this chunk; redo it once Ollama is back, cached answers make that cheap
+        debug_log(f'Ollama breaker opened, holding category rebuild {job_id} at {after_id}')
+        redis_client.hset(CATEGORY_REBUILD_KEY, 'updated_at', time.time())
+        enqueue_category_rebuild(job_id, after_id, countdown=BREAKER_COOLDOWN)
+        return
+
+    # Advance over the leading articles that got a confident answer
+    answered = 0
+    while answered < len(rows) and rows[answered].id in confident:
+        answered += 1
+    skipped = 0
+    if not answered:
+        if redis_client.hincrby(CATEGORY_REBUILD_KEY, 'attempts', 1) < CATEGORY_REBUILD_MAX_ATTEMPTS:
+            debug_log(f'No confident answer for article {rows[0].id}, retrying category rebuild {job_id} at {after_id}')
+            enqueue_category_rebuild(job_id, after_id)
+            return
+        debug_log(f'Skipping article {rows[0].id} in category rebuild {job_id}, its categories are kept')
+        answered = skipped = 1
+    last_id = rows[answered - 1].id
+    if not _advance_checkpoint(keys=[CATEGORY_REBUILD_KEY], args=[job_id, after_id, last_id, answered, skipped, time.time()]):
+        debug_log(f'Another message already continued category rebuild {job_id} after {after_id}')
+        return
+    enqueue_category_rebuild(job_id, last_id)
+
+def get_related_rebuild_status() -> Dict[str, Any]:
+    return get_rebuild_status(RELATED_REBUILD_KEY)
+
+def start_related_rebuild() -> Dict[str, Any]:
+    """Recompute every article's related links; the API keeps serving the old links until the swap."""
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    pipe = redis_client.pipeline()
+    pipe.delete(RELATED_REBUILD_KEY)
+    pipe.hset(RELATED_REBUILD_KEY, mapping={
+        'job_id': job_id, 'status': 'running', 'processed': 0, 'total': 0, 'started_at': now, 'updated_at': now,
+    })
+    pipe.execute()
+    rebuild_related.delay(job_id)
+    return get_related_rebuild_status()
+
+@celery_app.task(bind=True, max_retries=3, default_retry_delay=60)
+def rebuild_related(self, job_id: str):
+    """
+    Split the corpus into id ranges of RELATED_REBUILD_CHUNK_SIZE articles and
+    fan them out as rebuild_related_chunk tasks, so every worker process takes
+    part; swap_related runs once all of them have finished.
+    """
+    if get_rebuild_state(RELATED_REBUILD_KEY).get('job_id') != job_id:
+        return
+    db = SessionLocal()
+    try:
+        article_ids = db.execute(select(Article.id).order_by(Article.id)).scalars().all()
+        # Drop purged articles from the TF-IDF matrix (building it if none is stored) once, before the chunks read it
+        prune_index(db)
+    except Exception as e:
+        debug_log(f'Exception in rebuild_related: {e}')
+        db.rollback()
+        if self.request.retries >= self.max_retries:
+            redis_client.hset(RELATED_REBUILD_KEY, mapping={'status': 'failed', 'error': str(e), 'updated_at': time.time()})
+        self.retry(exc=e)
+    finally:
+        db.close()
+    redis_client.hset(RELATED_REBUILD_KEY, mapping={
+        'total': len(article_ids), 'max_id': article_ids[-1] if article_ids else 0, 'updated_at': time.time()
+    })
+    ranges = [
+        (article_ids[i], article_ids[min(i + RELATED_REBUILD_CHUNK_SIZE, len(article_ids)) - 1])
+        for i in range(0, len(article_ids), RELATED_REBUILD_CHUNK_SIZE)
+    ]
+    if not ranges:
+        swap_related.delay(job_id)
+        return
+    chord(group(rebuild_related_chunk.si(job_id, first_id, last_id) for first_id, last_id in ranges))(swap_related.si(job_id))
+
+@celery_app.task(bind=True, max_retries=3, default_retry_delay=60)
+def rebuild_related_chunk(self, job_id: str, first_id: int, last_id: int):
+    """Compute the related links of the articles with ids in [first_id, last_id] into the staging table."""
+    db = SessionLocal()
+    try:
+        article_ids = db.execute(
+            select(Article.id).where(Article.id >= first_id, Article.id <= last_id)
+        ).scalars().all()
+        related = drop_purged(db, find_related_articles(db, article_ids))
+        # Replace rather than append, so a retried chunk does not stage its links twice
+        db.execute(delete(article_related_staging).where(
+            article_related_staging.c.job_id == job_id,
+            article_related_staging.c.article_id.between(first_id, last_id)
+        ))
+        rows = [
+            {'job_id': job_id, 'article_id': article_id, 'related_article_id': related_id}
+            for article_id, related_ids in related.items()
+            for related_id in related_ids
+        ]
+        if rows:
+            db.execute(insert(article_related_staging), rows)
+        db.commit()
+        redis_client.hincrby(RELATED_REBUILD_KEY, 'processed', len(article_ids))
+        redis_client.hset(RELATED_REBUILD_KEY, 'updated_at', time.time())
+    except Exception as e:
+        debug_log(f'Exception in rebuild_related_chunk: {e}')
+        db.rollback()
+        if self.request.retries >= self.max_retries and get_rebuild_state(RELATED_REBUILD_KEY).get('job_id') == job_id:
+            # swap_related never runs once a chunk has failed for good
+            redis_client.hset(RELATED_REBUILD_KEY, mapping={'status': 'failed', 'error': str(e), 'updated_at': time.time()})
+        self.retry(exc=e)
+    finally:
+        db.close()
+
+@celery_app.task(bind=True, max_retries=3, default_retry_delay=60)
+def swap_related(self, job_id: str):
+    """
+    Replace the related links of every article the rebuild covered with the
+    staged ones in a single transaction, so readers see either the old or the
+    new links. Articles ingested after the rebuild started keep their links.
+    Stories are reclustered from the new links in the same transaction.
+    """
+    state = get_rebuild_state(RELATED_REBUILD_KEY)
+    db = SessionLocal()
+    try:
+        if state.get('job_id') == job_id:
+            max_id = int(state.get('max_id', 0))
+            with story_lock():
+                db.execute(delete(article_related).where(article_related.c.article_id <= max_id))
+                db.execute(insert(article_related).from_select(
+                    ['article_id', 'related_article_id'],
+                    select(article_related_staging.c.article_id, article_related_staging.c.related_article_id)
+                    .where(article_related_staging.c.job_id == job_id)
+                ))
+                db.execute(delete(article_related_staging).where(article_related_staging.c.job_id == job_id))
+                rebuild_stories(db)
+                db.commit()
+        else:
+            debug_log(f'Related rebuild {job_id} was superseded, discarding its staged links')
+            db.execute(delete(article_related_staging).where(article_related_staging.c.job_id == job_id))
+            db.commit()
+    except Exception as e:
+        debug_log(f'Exception in swap_related: {e}')
+        db.rollback()
+        if self.request.retries >= self.max_retries:
+            redis_client.hset(RELATED_REBUILD_KEY, mapping={'status': 'failed', 'error': str(e), 'updated_at': time.time()})
+        self.retry(exc=e)
+    finally:
+        db.close()
+    if state.get('job_id') == job_id:
+        redis_client.hset(RELATED_REBUILD_KEY, mapping={'status': 'done', 'updated_at': time.time()})
+        debug_log(f'Related rebuild {job_id} finished')
+
 @celery_app.task(
     bind=True,
     max_retries=3,
@@ -577,77 +1078,73 @@ def enrich_articles(self):
     debug_log('Starting enrich_articles task')
     db = SessionLocal()
     try:
-        # Find articles that need enrichment
+        # Find articles that need enrichment, newest first so the front page is served first
         articles_to_enrich = db.query(Article).filter(
-            (Article.description == '') | 
-            (Article.thumbnail_url == None)
-        ).all()
-        
-        debug_log(f'Found {len(articles_to_enrich)} articles to enrich')
-        
-        for article in articles_to_enrich:
-            try:
-                debug_log(f'Enriching article: {article.link}')
-                
-                # Fetch and parse the article
-                downloaded = trafilatura.fetch_url(article.link)
-                if not downloaded:
-                    debug_log(f'Failed to fetch article: {article.link}')
-                    continue
-                
-                # Extract article content
-                content = trafilatura.extract(downloaded, include_images=True, include_links=True)
-                if not content:
-                    debug_log(f'Failed to extract content from: {article.link}')
-                    continue
-                
-                # Parse with BeautifulSoup to find images
-                soup = BeautifulSoup(downloaded, 'html.parser')
-                
-                # Find the first suitable image
-                image_url = None
-                for img in soup.find_all('img'):
-                    src = img.get('src', '')
-                    if src and not src.startswith('data:'):
-                        # Convert relative URLs to absolute
-                        if not src.startswith(('http://', 'https://')):
-                            parsed_url = urlparse(article.link)
-                            base_url = f"{parsed_url.scheme}://{parsed_url.netloc}"
-                            src = base_url + ('' if src.startswith('/') else '/') + src
-                        # Skip if it's probably an icon
-                        if is_probably_icon(src):
-                            continue
-                        # Skip if it's a small image
-                        if is_small_image(src):
-                            continue
-                        image_url = src
-                        break
-                
-                # Update article with new content
-                if not article.description and content:
-                    article.description = content[:1000]  # Limit description length
-                    article.content = content
-                
-                if not article.thumbnail_url and image_url:
-                    thumbnail_url = save_thumbnail(image_url, article.id)
-                    if thumbnail_url:
-                        article.thumbnail_url = thumbnail_url
-                        article.image_url = image_url
-                
-                db.commit()
-                debug_log(f'Successfully enriched article: {article.link}')
-                
-                # Add a small delay between requests to be polite
-                time.sleep(1)
-                
-            except Exception as e:
-                debug_log(f'Error enriching article {article.link}: {str(e)}')
-                db.rollback()
-                continue
-                
+            (Article.description == '') |
+            (Article.thumbnail_url == None),
+            Article.canonical_id == None  # Near-duplicates inherit from their canonical article
+        ).order_by(Article.published_at.desc()).all()
+        candidates = [
+            {
+                'id': article.id,
+                'link': article.link,
+                'needs_description': not article.description,
+                'needs_thumbnail': not article.thumbnail_url,
+            }
+            for article in articles_to_enrich
+        ]
+        debug_log(f'Found {len(candidates)} articles to enrich')
+        enriched = asyncio.get_event_loop().run_until_complete(store_enrichments(db, candidates))
+        debug_log(f'Enriched {enriched} of {len(candidates)} articles')
     except Exception as e:
         debug_log(f'Exception in enrich_articles: {e}')
+        db.rollback()
         self.retry(exc=e)
     finally:
         db.close()
-        debug_log('enrich_articles task finished') 
\ No newline at end of file
+        debug_log('enrich_articles task finished')
+
+async def store_enrichments(db: Session, candidates: List[Dict[str, Any]]) -> int:
+    """
+    Apply enrichment results as they arrive, committing every
+    ENRICH_COMMIT_BATCH_SIZE articles. Database work runs in the default
+    executor, as in ingest_articles, so it does not stall the fetches.
+    """
+    loop = asyncio.get_running_loop()
+    enriched = 0
+    pending: List[int] = []
+
+    def apply(result: Dict[str, Any]) -> bool:
+        article = db.get(Article, result['id'])
+        if article is None:  # Purged while it was being enriched
+            return False
+        if 'content' in result and not article.description:
+            article.description = result['content'][:DESCRIPTION_LENGTH]
+            article.content = result['content']
+        if 'thumbnail_url' in result and not article.thumbnail_url:
+            article.thumbnail_url = result['thumbnail_url']
+            article.image_url = result['image_url']
+        debug_log(f'Successfully enriched article: {article.link}')
+        return True
+
+    def commit(article_ids: List[int]):
+        try:
+            share_with_near_duplicates(db, article_ids)
+            db.commit()
+        except Exception as e:
+            debug_log(f'Failed to store enrichment of articles {article_ids}: {e}')
+            db.rollback()
+
+    async for result in enrich(candidates):
+        if 'content' not in result and 'thumbnail_url' not in result:
+            continue
+        if not await loop.run_in_executor(None, apply, result):
+            continue
+        enriched += 1
+        pending.append(result['id'])
+        if len(pending) >= ENRICH_COMMIT_BATCH_SIZE:
+            await loop.run_in_executor(None, commit, pending)
+            pending = []
+    if pending:
+        await loop.run_in_executor(None, commit, pending)
+    return enriched
@@ -0,0 +1,325 @@
+"""
+TF-IDF related-article engine over title and description.
+
+The retained corpus is kept as a sparse (articles x vocabulary) matrix of
+raw term counts, with the article id of every row and the vocabulary in
+column order. New tokens are appended to the vocabulary and changed
+articles replace their row. Purged articles are dropped by prune_index,
+once per purge rather than on every update. Any update takes a Redis
+lock, so ingest and the admin rebuild never write over each other.
+
+Redis holds a snapshot of the matrix plus the list of updates applied
+since, each just the ids and texts of one ingested page. Every process
+keeps the index in memory and only reads the updates it has not applied
+yet, so an ingested page costs a few kilobytes rather than a rewrite and
+re-download of the whole matrix. The snapshot is rewritten after
+SNAPSHOT_EVERY updates, and on build and prune.
+
+Lookups weight the counts by sublinear TF and smoothed IDF and
+L2-normalize the rows. News articles nearly all share some token, so the
+scores of a query against the corpus are effectively dense: queries are
+scored SCORE_BATCH_SIZE at a time into a dense (queries x corpus) array,
+and only the top k of each row are kept, found with argpartition.
+"""
+
+import io
+import json
+import os
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import redis
+import scipy.sparse as sp
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.models.database import Article
+from app.workers import debug_log
+from app.workers.tokens import token_counts
+
+TFIDF_LOCK_TIMEOUT = int(os.environ.get('WORKER_TFIDF_LOCK_TIMEOUT', 120))
+# Title tokens count this many times, so a headline outweighs a long summary
+TITLE_WEIGHT = 2
+BUILD_BATCH_SIZE = 1000
+# Queries scored per dense (queries x corpus) float32 array, about 13 MB at 50k articles
+SCORE_BATCH_SIZE = 64
+# Updates appended before the snapshot is rewritten
+SNAPSHOT_EVERY = 50
+
+INDEX_KEY = 'tfidf:index'
+VERSION_KEY = 'tfidf:version'
+UPDATES_KEY = 'tfidf:updates'
+LOCK_KEY = 'tfidf:lock'
+
+# The index is binary, so this client does not decode responses
+redis_client = redis.Redis.from_url(os.getenv('REDIS_URL', 'redis://redis:6379/0'))
+
+
+class TfidfIndex:
+    """Term counts of the retained corpus: row i of counts belongs to ids[i], column j to vocabulary[j]."""
+
+    def __init__(self, ids: np.ndarray, vocabulary: List[str], counts: sp.csr_matrix):
+        self.ids = ids
+        self.vocabulary = vocabulary
+        self.columns = {token: column for column, token in enumerate(vocabulary)}
+        self.counts = counts
+        self.rows = {int(article_id): row for row, article_id in enumerate(ids)}
+        self._weighted: Optional[sp.csr_matrix] = None
+        self._weighted_t: Optional[sp.csr_matrix] = None
+        self._idf: Optional[np.ndarray] = None
+
+    @classmethod
+    def empty(cls) -> 'TfidfIndex':
+        return cls(np.zeros(0, dtype=np.int64), [], sp.csr_matrix((0, 0), dtype=np.float32))
+
+    def vectorize(self, texts: List[str], grow: bool) -> sp.csr_matrix:
+        """Count matrix of texts; new tokens are added to the vocabulary when grow is set, otherwise ignored."""
+        indptr, indices, data = [0], [], []
+        for text in texts:
+            for token, count in token_counts(text).items():
+                column = self.columns.get(token)
+                if column is None:
+                    if not grow:
+                        continue
+                    column = self.columns[token] = len(self.vocabulary)
+                    self.vocabulary.append(token)
+                indices.append(column)
+                data.append(count)
+            indptr.append(len(indices))
+        return sp.csr_matrix((np.array(data, dtype=np.float32), np.array(indices, dtype=np.int32), np.array(indptr)),
+                             shape=(len(texts), len(self.vocabulary)))
+
+    def update(self, articles: Dict[int, str], existing_ids: Optional[Iterable[int]] = None):
+        """Replace or add the rows of articles and drop rows whose id is not in existing_ids."""
+        keep = ~np.isin(self.ids, list(articles))
+        if existing_ids is not None:
+            keep &= np.isin(self.ids, np.fromiter(existing_ids, dtype=np.int64))
+        added = self.vectorize(list(articles.values()), grow=True)
+        counts = self.counts[keep]
+        counts.resize((counts.shape[0], len(self.vocabulary)))
+        self.ids = np.concatenate([self.ids[keep], np.fromiter(articles, dtype=np.int64, count=len(articles))])
+        self.counts = sp.vstack([counts, added], format='csr')
+        self._compact()
+        self.rows = {int(article_id): row for row, article_id in enumerate(self.ids)}
+        self._weighted = self._weighted_t = self._idf = None
+
+    def _compact(self):
+        """Drop vocabulary entries no longer used by any article once they make up half of it."""
+        document_frequency = np.bincount(self.counts.indices, minlength=len(self.vocabulary))
+        used = document_frequency > 0
+        if used.sum() * 2 >= len(self.vocabulary):
+            return
+        new_column = np.cumsum(used) - 1
+        self.counts = sp.csr_matrix((self.counts.data, new_column[self.counts.indices], self.counts.indptr),
+                                    shape=(self.counts.shape[0], int(used.sum())))
+        self.vocabulary = [token for token, keep in zip(self.vocabulary, used) if keep]
+        self.columns = {token: column for column, token in enumerate(self.vocabulary)}
+
+    @property
+    def idf(self) -> np.ndarray:
+        if self._idf is None:
+            document_frequency = np.bincount(self.counts.indices, minlength=len(self.vocabulary))
+            self._idf = (np.log((1 + len(self.ids)) / (1 + document_frequency)) + 1).astype(np.float32)
+        return self._idf
+
+    def weight(self, counts: sp.csr_matrix) -> sp.csr_matrix:
+        """Sublinear TF times IDF, each row scaled to unit length."""
+        weighted = counts.copy()
+        weighted.data = (1 + np.log(weighted.data)) * self.idf[weighted.indices]
+        norms = np.sqrt(np.asarray(weighted.multiply(weighted).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        return sp.csr_matrix(sp.diags(1 / norms) @ weighted)
+
+    @property
+    def weighted(self) -> sp.csr_matrix:
+        if self._weighted is None:
+            self._weighted = self.weight(self.counts)
+        return self._weighted
+
+    @property
+    def weighted_t(self) -> sp.csr_matrix:
+        """The transposed weighted matrix, kept in CSR so products with it need no conversion."""
+        if self._weighted_t is None:
+            self._weighted_t = self.weighted.T.tocsr()
+        return self._weighted_t
+
+    def related(self, article_ids: List[int], threshold: float, k: int) -> Dict[int, List[int]]:
+        """Top k rows by cosine similarity for each indexed article, scored SCORE_BATCH_SIZE queries at a time."""
+        present = [article_id for article_id in article_ids if article_id in self.rows]
+        related: Dict[int, List[int]] = {article_id: [] for article_id in article_ids}
+        if not present or not len(self.ids) or k <= 0:
+            return related
+        query_rows = np.array([self.rows[article_id] for article_id in present])
+        top_k = min(k, len(self.ids))
+        for start in range(0, len(present), SCORE_BATCH_SIZE):
+            batch = query_rows[start:start + SCORE_BATCH_SIZE]
+            scores = (self.weighted[batch] @ self.weighted_t).toarray()
+            scores[np.arange(len(batch)), batch] = -1  # An article is not related to itself
+            tops = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+            for i, columns in enumerate(tops):
+                values = scores[i, columns]
+                keep = values >= threshold
+                columns, values = columns[keep], values[keep]
+                order = np.lexsort((-self.ids[columns], -values))
+                related[present[start + i]] = [int(self.ids[column]) for column in columns[order]]
+        return related
+
+    def to_bytes(self) -> bytes:
+        buffer = io.BytesIO()
+        # Uncompressed: compression costs about 100x the time
+        np.savez(
+            buffer, ids=self.ids, data=self.counts.data, indices=self.counts.indices, indptr=self.counts.indptr,
+            shape=np.array(self.counts.shape), vocabulary=np.frombuffer(json.dumps(self.vocabulary).encode('utf-8'), dtype=np.uint8)
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'TfidfIndex':
+        with np.load(io.BytesIO(data)) as archive:
+            counts = sp.csr_matrix((archive['data'], archive['indices'], archive['indptr']), shape=tuple(archive['shape']))
+            return cls(archive['ids'], json.loads(archive['vocabulary'].tobytes().decode('utf-8')), counts)
+
+
+def article_text(title: Optional[str], description: Optional[str]) -> str:
+    return ' '.join([title or ''] * TITLE_WEIGHT + [description or ''])
+
+
+def load_article_texts(db: Session, article_ids: Iterable[int]) -> Dict[int, str]:
+    rows = db.execute(select(Article.id, Article.title, Article.description).where(Article.id.in_(list(article_ids)))).all()
+    return {row.id: article_text(row.title, row.description) for row in rows}
+
+
+def encode_update(articles: Dict[int, str]) -> bytes:
+    return zlib.compress(json.dumps([[article_id, text] for article_id, text in articles.items()]).encode('utf-8'))
+
+
+def decode_update(data: bytes) -> Dict[int, str]:
+    return {article_id: text for article_id, text in json.loads(zlib.decompress(data).decode('utf-8'))}
+
+
+_index: Optional[TfidfIndex] = None
+_index_version: Optional[bytes] = None
+# Updates after the snapshot already applied to _index
+_index_updates = 0
+
+
+def load_index() -> Tuple[Optional[TfidfIndex], Optional[bytes]]:
+    """
+    The persisted index with every update since its snapshot. The snapshot is
+    only deserialized when it changed since the last call in this process;
+    otherwise only the updates not applied yet are read.
+    """
+    global _index, _index_version, _index_updates
+    # Transactions, so the snapshot and its update list are read as one
+    pipe = redis_client.pipeline()
+    pipe.get(VERSION_KEY)
+    pipe.lrange(UPDATES_KEY, _index_updates, -1)
+    version, updates = pipe.execute()
+    if version is None:
+        return None, None
+    if version != _index_version:
+        pipe.get(VERSION_KEY)
+        pipe.get(INDEX_KEY)
+        pipe.lrange(UPDATES_KEY, 0, -1)
+        version, data, updates = pipe.execute()
+        if version is None or data is None:
+            return None, None
+        _index, _index_version, _index_updates = TfidfIndex.from_bytes(data), version, 0
+    for update in updates:
+        _index.update(decode_update(update))
+    _index_updates += len(updates)
+    return _index, _index_version
+
+
+def save_index(index: TfidfIndex):
+    """Write a new snapshot and drop the updates it includes."""
+    global _index, _index_version, _index_updates
+    version = str(int(redis_client.incr(f'{VERSION_KEY}:counter'))).encode()
+    pipe = redis_client.pipeline()
+    pipe.set(INDEX_KEY, index.to_bytes())
+    pipe.set(VERSION_KEY, version)
+    pipe.delete(UPDATES_KEY)
+    pipe.execute()
+    _index, _index_version, _index_updates = index, version, 0
+
+
+def append_update(index: TfidfIndex, articles: Dict[int, str]):
+    """Persist articles already applied to index, which must be this process's up-to-date copy."""
+    global _index_updates
+    _index_updates = redis_client.rpush(UPDATES_KEY, encode_update(articles))
+    if _index_updates >= SNAPSHOT_EVERY:
+        save_index(index)
+
+
+def build_index(db: Session) -> TfidfIndex:
+    """Count matrix of every stored article, read in keyset-ordered batches."""
+    index = TfidfIndex.empty()
+    last_id = 0
+    while True:
+        rows = db.execute(
+            select(Article.id, Article.title, Article.description)
+            .where(Article.id > last_id).order_by(Article.id).limit(BUILD_BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        index.update({row.id: article_text(row.title, row.description) for row in rows})
+        last_id = rows[-1].id
+    return index
+
+
+def update_index(db: Session, article_ids: Iterable[int], prune: bool = False) -> Optional[TfidfIndex]:
+    """
+    Add or refresh the given articles under the index lock and append them
+    to the stored updates. With prune set, articles no longer stored are also
+    dropped and a new snapshot is written. Builds the whole index if none is
+    stored yet. Returns None if the lock could not be taken in time.
+    """
+    global _index_version
+    lock = redis_client.lock(LOCK_KEY, timeout=TFIDF_LOCK_TIMEOUT, blocking_timeout=TFIDF_LOCK_TIMEOUT)
+    if not lock.acquire():
+        debug_log('Timed out waiting for the TF-IDF index lock')
+        return None
+    try:
+        index, _ = load_index()
+        if index is None:
+            index = build_index(db)
+            debug_log(f'Built TF-IDF index of {len(index.ids)} articles and {len(index.vocabulary)} tokens')
+            save_index(index)
+        elif prune:
+            index.update(load_article_texts(db, article_ids), db.execute(select(Article.id)).scalars().all())
+            save_index(index)
+        else:
+            articles = load_article_texts(db, article_ids)
+            if articles:
+                index.update(articles)
+                append_update(index, articles)
+        return index
+    except Exception:
+        # The cached index may have been changed in place; reload it from Redis next time
+        _index_version = None
+        raise
+    finally:
+        try:
+            lock.release()
+        except redis.exceptions.LockError:
+            debug_log('TF-IDF index lock expired before it was released')
+
+
+def prune_index(db: Session) -> Optional[TfidfIndex]:
+    """Drop purged articles from the index."""
+    return update_index(db, [], prune=True)
+
+
+def find_related_articles(db: Session, article_ids: List[int], threshold: float, k: int) -> Dict[int, List[int]]:
+    """
+    For each article, the ids of up to k other articles whose TF-IDF cosine
+    similarity is at least threshold, most similar first.
+    """
+    index, _ = load_index()
+    missing = [article_id for article_id in article_ids if index is None or article_id not in index.rows]
+    if missing:
+        index = update_index(db, missing) or index
+    if index is None:
+        return {article_id: [] for article_id in article_ids}
+    return index.related(article_ids, threshold, k)
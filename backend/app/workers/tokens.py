@@ -0,0 +1,27 @@
+"""
+Text normalization shared by the related-article indexes.
+"""
+
+import re
+from collections import Counter
+from typing import Set
+
+_TAG_RE = re.compile(r'<[^>]+>')
+_TOKEN_RE = re.compile(r'\w+')
+# Words too common in headlines to say anything about relatedness
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have he her his how in is it its of on or our over says she that the their
+they this to up was we what when who why will with you your into new not more than about but can
+""".split())
+
+
+def word_tokens(text: str) -> Set[str]:
+    """Distinct lowercased word tokens of text, HTML tags removed, without stopwords and single characters."""
+    return {token for token in _TOKEN_RE.findall(_TAG_RE.sub(' ', text or '').lower())
+            if len(token) > 1 and token not in STOPWORDS}
+
+
+def token_counts(text: str) -> Counter:
+    """Occurrences of each word token of text, with the same filtering as word_tokens."""
+    return Counter(token for token in _TOKEN_RE.findall(_TAG_RE.sub(' ', text or '').lower())
+                   if len(token) > 1 and token not in STOPWORDS)